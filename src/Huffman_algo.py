@@ -1,6 +1,8 @@
 import heapq
+import struct
 import numpy as np
-from collections import Counter
+from bitstream import pack_codes, unpack_bits
+import metrics
 
 
 class Node():
@@ -49,6 +51,234 @@ class Leaf():
         text[self.symbol] = prefix
 
 
+MAX_CODE_LENGTH = 32
+# number of bits resolved by one decode table probe
+TABLE_BITS = 11
+# number of symbols coded with one table by Compressor
+DEFAULT_BLOCK_SIZE = 1 << 16
+
+
+def code_lengths(counts: np.array) -> np.array:
+    '''
+    Returns Huffman code length of every symbol with the given counts.
+    Counts are flattened until no code is longer than MAX_CODE_LENGTH.
+    '''
+    counts = np.asarray(counts, dtype='int64')
+    while True:
+        tree = []
+        coded_text = {}
+        for symbol_index, frequency in enumerate(counts.tolist()):
+            tree.append((frequency, len(tree), Leaf(symbol_index)))
+
+        heapq.heapify(tree)
+        indicator = len(tree)
+
+        while len(tree) > 1:
+            first_frequency, _, left = heapq.heappop(tree)
+            second_frequency, _, right = heapq.heappop(tree)
+            heapq.heappush(tree, (first_frequency + second_frequency, indicator, Node(left, right)))
+            indicator += 1
+
+        if tree:
+            [(_, _, root)] = tree
+            root.move(coded_text, '')
+
+        lengths = np.array([len(coded_text[index]) for index in range(len(counts))], dtype='int64')
+        if lengths.max(initial=0) <= MAX_CODE_LENGTH:
+            return lengths
+        counts = (counts >> 1) | 1
+
+
+def canonical_codes(lengths: np.array) -> np.array:
+    '''
+    Assigns canonical codes: shorter codes first, equal lengths in symbol
+    order, so the code lengths alone describe the whole code.
+    '''
+    lengths = np.asarray(lengths, dtype='int64')
+    codes = np.zeros(len(lengths), dtype='uint64')
+    code, previous_length = 0, 0
+    for index in np.lexsort((np.arange(len(lengths)), lengths)).tolist():
+        code <<= int(lengths[index]) - previous_length
+        previous_length = int(lengths[index])
+        codes[index] = code
+        code += 1
+    return codes
+
+
+def decode_table(codes: np.array, lengths: np.array):
+    '''
+    Builds the lookup table indexed by the next TABLE_BITS bits of input.
+    Every entry holds the symbol indexes decoded from those bits and the
+    number of bits they take (0 if the first code is longer than the table).
+    '''
+    size = 1 << TABLE_BITS
+    first_symbols = np.full(size, -1, dtype='int64')
+    first_lengths = np.zeros(size, dtype='int64')
+    for index in np.flatnonzero(lengths <= TABLE_BITS).tolist():
+        span = 1 << (TABLE_BITS - int(lengths[index]))
+        start = int(codes[index]) * span
+        first_symbols[start:start + span] = index
+        first_lengths[start:start + span] = lengths[index]
+
+    first_symbols = first_symbols.tolist()
+    first_lengths = first_lengths.tolist()
+    table = []
+    for window in range(size):
+        symbols, used = [], 0
+        while True:
+            rest = (window << used) & (size - 1)
+            if first_symbols[rest] < 0 or used + first_lengths[rest] > TABLE_BITS:
+                break
+            symbols.append(first_symbols[rest])
+            used += first_lengths[rest]
+        table.append((tuple(symbols), used))
+    return table
+
+
+def decode_bits(packed: np.array, bit_length: int, codes: np.array, lengths: np.array) -> np.array:
+    '''
+    Decodes packed bits into symbol indexes of the given prefix code.
+    The TABLE_BITS bits at the current position are read from the three
+    bytes holding them, only at the positions where codes start.
+    '''
+    data = np.frombuffer(packed, dtype='uint8').tobytes() + bytes(3)
+    codes = np.asarray(codes, dtype='uint64')
+    lengths = np.asarray(lengths, dtype='int64')
+    table = decode_table(codes, lengths)
+    long_codes = {
+        (int(lengths[index]), int(codes[index])): index
+        for index in np.flatnonzero(lengths > TABLE_BITS).tolist()
+    }
+    table_mask = (1 << TABLE_BITS) - 1
+    window_shift = 24 - TABLE_BITS
+
+    res = []
+    position = 0
+    while position < bit_length:
+        byte = position >> 3
+        window = (
+            (data[byte] << 16 | data[byte + 1] << 8 | data[byte + 2])
+            >> (window_shift - (position & 7)) & table_mask
+        )
+        symbols, used = table[window]
+        if used and position + used <= bit_length:
+            res.extend(symbols)
+            position += used
+            continue
+
+        # code longer than the table or the last bits of the input
+        code = 0
+        for length in range(1, MAX_CODE_LENGTH + 1):
+            if position + length > bit_length:
+                raise ValueError('Huffman bitstream ends in the middle of a code')
+            bit_position = position + length - 1
+            code = code << 1 | (data[bit_position >> 3] >> (7 - (bit_position & 7)) & 1)
+            if length <= TABLE_BITS:
+                symbol_end = table[code << (TABLE_BITS - length)]
+                if symbol_end[0] and lengths[symbol_end[0][0]] == length:
+                    res.append(symbol_end[0][0])
+                    break
+            elif (length, code) in long_codes:
+                res.append(long_codes[(length, code)])
+                break
+        else:
+            raise ValueError('Invalid Huffman code in bitstream')
+        position += length
+
+    return np.array(res, dtype='int64')
+
+
+# number of symbols and their dtype, then code lengths, bit length and the packed bits
+BLOCK_HEADER = struct.Struct('<I4s')
+BIT_LENGTH = struct.Struct('<Q')
+
+
+def pack_block(packed: np.array, bit_length: int, table: np.array) -> bytes:
+    '''
+    Serializes output of HuffmanCode.encode_packed: the symbol table in the
+    smallest dtype that holds all symbols, code lengths and packed bits.
+    '''
+    symbols = table['symbol']
+    symbol_dtype = np.dtype('uint8')
+    if len(symbols):
+        symbol_dtype = np.promote_types(
+            np.min_scalar_type(symbols.min()), np.min_scalar_type(symbols.max())
+        )
+    return b''.join([
+        BLOCK_HEADER.pack(len(table), symbol_dtype.str.encode()),
+        symbols.astype(symbol_dtype.newbyteorder('<')).tobytes(),
+        table['length'].astype('uint8').tobytes(),
+        BIT_LENGTH.pack(bit_length),
+        np.asarray(packed, dtype='uint8')[:(bit_length + 7) // 8].tobytes(),
+    ])
+
+
+def read_block(buffer, position: int=0):
+    '''
+    Reads a block written by pack_block from the buffer at the given position.
+    Returns packed bits, bit length, table and the position after the block.
+    '''
+    buffer = np.frombuffer(buffer, dtype='uint8')
+    symbols_num, symbol_dtype = BLOCK_HEADER.unpack_from(buffer, position)
+    symbol_dtype = np.dtype(symbol_dtype.rstrip(b'\x00').decode()).newbyteorder('<')
+    position += BLOCK_HEADER.size
+
+    table = np.zeros(symbols_num, dtype=[('symbol', symbol_dtype.newbyteorder('=')), ('length', 'uint8')])
+    table['symbol'] = np.frombuffer(buffer, dtype=symbol_dtype, count=symbols_num, offset=position)
+    position += symbols_num * symbol_dtype.itemsize
+    table['length'] = buffer[position:position + symbols_num]
+    position += symbols_num
+
+    (bit_length,) = BIT_LENGTH.unpack_from(buffer, position)
+    position += BIT_LENGTH.size
+    packed = buffer[position:position + (bit_length + 7) // 8]
+    return packed, bit_length, table, position + len(packed)
+
+
+def block_end(buffer, position: int=0):
+    '''
+    Returns the position after the block written by pack_block starting at
+    the given position, or None if the buffer ends before the block does.
+    '''
+    buffer = np.frombuffer(buffer, dtype='uint8')
+    if len(buffer) < position + BLOCK_HEADER.size:
+        return None
+    symbols_num, symbol_dtype = BLOCK_HEADER.unpack_from(buffer, position)
+    symbol_dtype = np.dtype(symbol_dtype.rstrip(b'\x00').decode())
+    position += BLOCK_HEADER.size + symbols_num * (symbol_dtype.itemsize + 1)
+    if len(buffer) < position + BIT_LENGTH.size:
+        return None
+    (bit_length,) = BIT_LENGTH.unpack_from(buffer, position)
+    position += BIT_LENGTH.size + (bit_length + 7) // 8
+    return position if len(buffer) >= position else None
+
+
+def encode_packet(data: np.array, level=None) -> bytes:
+    '''
+    Compresses the array into the payload of a container packet,
+    Huffman coding has no levels
+    '''
+    return pack_block(*HuffmanCode(np.asarray(data).ravel()).encode_packed())
+
+
+def decode_packet(payload) -> np.array:
+    '''
+    Decompresses the payload of a container packet
+    '''
+    packed, bit_length, table, _ = read_block(payload)
+    return HuffmanCode(packed).decode_packed(bit_length, table)
+
+
+def decode_legacy_packet(stored) -> np.array:
+    '''
+    Decompresses (packed bits, bit length, table) or (code string, code dict)
+    stored in np.savez_compressed archives of older versions
+    '''
+    if len(stored) == 3:
+        return HuffmanCode(stored[0]).decode_packed(*stored[1:])
+    return HuffmanCode(stored[0]).decode(stored[1])
+
+
 class HuffmanCode():
     '''
     Class for encoding and decoding numpy array with HuffmanCode.
@@ -58,7 +288,9 @@ class HuffmanCode():
     Methods
     -------
     encode()
+    encode_packed()
     decode()
+    decode_packed()
     '''
 
     def __init__(self, data):
@@ -70,42 +302,130 @@ class HuffmanCode():
 
     def encode(self):
         """[Encodes numpy array with HuffmanCode]
+        Returns encoded text as a string of '0' and '1' and the code table
         """
-        tree = []
-        coded_text = {}
-        count = Counter(self.data)
+        packed, bit_length, table = self.encode_packed()
+        encoded = (unpack_bits(packed, bit_length) + ord('0')).tobytes().decode()
+        codes = canonical_codes(table['length'])
+        coded_text = {
+            symbol: format(code, f'0{length}b')
+            for symbol, code, length in zip(table['symbol'].tolist(), codes.tolist(), table['length'].tolist())
+        }
+        return encoded, coded_text
 
-        for symbol, frequency in count.items():
-            tree.append((frequency, len(tree), Leaf(symbol)))
+    def encode_packed(self):
+        """[Encodes numpy array with canonical HuffmanCode into packed bits]
+        Returns uint8 buffer with the codes, number of bits used in it
+        and the table of symbols with their code lengths
+        """
+        with metrics.timer('huffman.build'):
+            symbols, symbol_indexes, counts = np.unique(
+                np.asarray(self.data).ravel(), return_inverse=True, return_counts=True
+            )
+            lengths = code_lengths(counts)
+            codes = canonical_codes(lengths)
+        with metrics.timer('huffman.pack'):
+            packed, bit_length = pack_codes(codes[symbol_indexes], lengths[symbol_indexes])
+        metrics.count('huffman.symbols', len(symbol_indexes))
+        metrics.count('huffman.bits', bit_length)
+        metrics.maximum('huffman.alphabet_size', len(symbols))
 
-        heapq.heapify(tree)
-        indicator = len(tree)
+        table = np.zeros(len(symbols), dtype=[('symbol', symbols.dtype), ('length', 'uint8')])
+        table['symbol'] = symbols
+        table['length'] = lengths
+        return packed, bit_length, table
 
-        while len(tree) > 1:
-            first_frequency, _, left = heapq.heappop(tree)
-            second_frequency, _, right = heapq.heappop(tree)
-            heapq.heappush(tree, (first_frequency + second_frequency, indicator, Node(left, right)))
-            indicator += 1
+    def decode (self, decode_dict):
+        """[Decodes coded text with HuffmanCode]
+        """
+        bits = np.frombuffer(self.data.encode(), dtype='uint8') - ord('0')
+        return HuffmanCode(np.packbits(bits)).decode_packed(len(bits), decode_dict)
 
-        if tree:
-            [(_, _, root)] = tree
-            root.move(coded_text, '')
+    def decode_packed(self, bit_length, table):
+        """[Decodes packed bits with HuffmanCode]
+        Table is either the table of code lengths from encode_packed
+        or a dict of symbols and their codes
+        """
+        if isinstance(table, dict):
+            symbols = np.array(list(table.keys()))
+            codes = np.array([int(code, 2) for code in table.values()], dtype='uint64')
+            lengths = np.array([len(code) for code in table.values()], dtype='int64')
+        else:
+            symbols = table['symbol']
+            lengths = table['length'].astype('int64')
+            codes = canonical_codes(lengths)
+        with metrics.timer('huffman.decode'):
+            return symbols[decode_bits(self.data, bit_length, codes, lengths)]
 
-        encoded = ''
-        for symbol in self.data:
-            encoded += str(coded_text[symbol])
-        return encoded, coded_text
 
-    def decode (self, decode_dict):
-        """[Decodes coded text with HuffmanCode]
+class Compressor():
+    '''
+    Incremental Huffman coder: symbols are buffered and every block_size
+    of them is coded with its own table into a block written by pack_block.
+    '''
+
+    def __init__(self, block_size: int=DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.buffer = []
+        self.buffered = 0
+
+    def feed(self, chunk) -> bytes:
+        """[Adds symbols, returns blocks of all full block_size parts]
         """
+        chunk = np.asarray(chunk).ravel()
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered < self.block_size:
+            return b''
+
+        data = np.concatenate(self.buffer)
+        whole = len(data) - len(data) % self.block_size
+        self.buffer = [data[whole:]]
+        self.buffered = len(data) - whole
+        return b''.join(
+            pack_block(*HuffmanCode(data[start:start + self.block_size]).encode_packed())
+            for start in range(0, whole, self.block_size)
+        )
+
+    def flush(self) -> bytes:
+        """[Returns the block of the buffered symbols]
+        """
+        data = np.concatenate(self.buffer) if self.buffer else np.array([])
+        self.buffer, self.buffered = [], 0
+        if len(data) == 0:
+            return b''
+        return pack_block(*HuffmanCode(data).encode_packed())
+
+
+class Decompressor():
+    '''
+    Incremental decoder of blocks written by Compressor.
+    '''
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, chunk) -> np.array:
+        """[Adds bytes, returns symbols of all complete blocks]
+        """
+        self.buffer += bytes(np.frombuffer(chunk, dtype='uint8'))
         res = []
-        while self.data:
-            for key in decode_dict.keys():
-                if self.data.startswith(decode_dict[key]):
-                    self.data = self.data[len(decode_dict[key]):]
-                    res.append(key)
-        return np.array(res)
+        position = 0
+        end = block_end(self.buffer, position)
+        while end is not None:
+            packed, bit_length, table, _ = read_block(self.buffer, position)
+            res.append(HuffmanCode(packed).decode_packed(bit_length, table))
+            position = end
+            end = block_end(self.buffer, position)
+        self.buffer = self.buffer[position:]
+        return np.concatenate(res) if res else np.array([], dtype='int64')
+
+    def flush(self) -> np.array:
+        """[Checks that the stream ended with a complete block]
+        """
+        if self.buffer:
+            raise ValueError('Huffman stream ends in the middle of a block')
+        return np.array([], dtype='int64')
 
 if __name__ == '__main__':
     msg_to_encode = np.array([-1,2,1,-3,-1,2,1,-1,-1,0,1,1,-1,-1,2,1,-3,-1,3,0,-2,1,1,-1,
@@ -0,0 +1,118 @@
+'''
+Lossless decorrelation of 16-bit audio samples before compression.
+
+Packets are transformed independently, so each can be decoded on its own.
+The stages used for a file are picked once by choose_stages:
+    - mid/side: stereo left and right channels are replaced by their
+      difference (side) and the right channel plus half of it (mid), which
+      is roughly their mean. Both channels of most music are close, so side
+      is small
+    - delta: every sample is replaced by its difference from the previous
+      sample of the same channel
+
+All arithmetic wraps around at 16 bits, so the results are int16 again and
+every step is exactly invertible.
+'''
+
+import numpy as np
+
+MID_SIDE = 'mid_side'
+DELTA = 'delta'
+DEFAULT_STAGES = (MID_SIDE, DELTA)
+# codecs of non-negative symbols (lzw) get samples shifted into [0, 2 ** 16)
+SAMPLE_OFFSET = 1 << 15
+
+
+def mid_side(samples: np.array) -> np.array:
+    '''
+    Turns (samples, 2) left/right channels into mid/side
+    '''
+    left, right = samples[:, 0], samples[:, 1]
+    side = left - right
+    mid = right + (side >> 1)
+    return np.stack([mid, side], axis=1)
+
+
+def inverse_mid_side(samples: np.array) -> np.array:
+    '''
+    Turns (samples, 2) mid/side channels back into left/right
+    '''
+    mid, side = samples[:, 0], samples[:, 1]
+    right = mid - (side >> 1)
+    left = right + side
+    return np.stack([left, right], axis=1)
+
+
+def delta(samples: np.array) -> np.array:
+    '''
+    Replaces samples with differences from the previous ones in every channel
+    '''
+    res = samples.copy()
+    res[1:] -= samples[:-1]
+    return res
+
+
+def inverse_delta(samples: np.array) -> np.array:
+    '''
+    Restores samples from differences
+    '''
+    return np.cumsum(samples, axis=0, dtype='int16')
+
+
+def encode_samples(samples: np.array, channels: int, stages=DEFAULT_STAGES) -> np.array:
+    '''
+    Applies the stages to interleaved int16 samples, returns interleaved int16 residuals
+    '''
+    res = np.asarray(samples, dtype='int16').reshape(-1, channels)
+    if MID_SIDE in stages and channels == 2:
+        res = mid_side(res)
+    if DELTA in stages:
+        res = delta(res)
+    return res.ravel()
+
+
+def decode_samples(residuals: np.array, channels: int, stages=DEFAULT_STAGES) -> np.array:
+    '''
+    Undoes encode_samples, returns interleaved int16 samples
+    '''
+    res = np.asarray(residuals).astype('int16').reshape(-1, channels)
+    if DELTA in stages:
+        res = inverse_delta(res)
+    if MID_SIDE in stages and channels == 2:
+        res = inverse_mid_side(res)
+    return res.ravel()
+
+
+def choose_stages(samples: np.array, channels: int) -> tuple:
+    '''
+    Returns DEFAULT_STAGES without the ones that do not make the residuals of
+    the samples smaller (mid/side on unrelated channels)
+    '''
+    samples = np.asarray(samples, dtype='int16')
+    stages = []
+    for stage in DEFAULT_STAGES:
+        if residuals_cost(encode_samples(samples, channels, stages + [stage])) < \
+                residuals_cost(encode_samples(samples, channels, stages)):
+            stages.append(stage)
+    return tuple(stages)
+
+
+def residuals_cost(residuals: np.array) -> int:
+    '''
+    Sum of absolute residuals, an estimate of how well they compress
+    '''
+    return int(np.abs(residuals.astype('int32')).sum())
+
+
+def to_symbols(samples: np.array) -> np.array:
+    '''
+    Shifts int16 samples into the non-negative lzw alphabet
+    '''
+    return (samples.astype('int32') + SAMPLE_OFFSET).astype('uint16')
+
+
+def from_symbols(symbols: np.array) -> np.array:
+    '''
+    Shifts lzw symbols back into int16 samples
+    '''
+    return (np.asarray(symbols) - SAMPLE_OFFSET).astype('int16')
@@ -0,0 +1,255 @@
+'''
+Batch conversion of many files in one process pool.
+
+Inputs are files, directories (searched recursively) and glob patterns;
+every supported media file found is converted by Convert in one of the
+pool processes, largest files first. A manifest (JSON) records the content
+hash and conversion settings of every converted file, so files whose
+content, codec and settings did not change since their output was written
+are skipped:
+
+    python3 src/batch.py media/ 'archive/**/*.png' --codec deflate --jobs 4
+'''
+
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+from time import perf_counter
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, List, Optional
+from convert import Convert, output_path, DEFAULT_KEYFRAME_INTERVAL, AUTO
+from registry import media_of, CODECS, DEFAULT_LEVEL, COMPRESSION_LEVELS
+from selection import RATIO, POLICIES, DEFAULT_TIME_BUDGET
+import metrics
+
+DEFAULT_MANIFEST = 'bzb_manifest.json'
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def is_source(path: str) -> bool:
+    '''
+    Whether the file is one convert.py can read
+    '''
+    try:
+        return os.path.splitext(path)[1][1:].lower() in media_of(path).sources
+    except ValueError:
+        return False
+
+
+def find_sources(inputs: Iterable[str]) -> List[str]:
+    '''
+    Returns absolute paths of the supported files among the inputs: files,
+    directories searched recursively and glob patterns
+    '''
+    found = []
+    for pattern in inputs:
+        paths = [pattern] if os.path.exists(pattern) else glob.glob(pattern, recursive=True)
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    found += [os.path.join(root, name) for name in sorted(names)]
+            else:
+                found.append(path)
+    return list(dict.fromkeys(os.path.abspath(path) for path in found if is_source(path)))
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(path: str, manifest: dict) -> None:
+    '''
+    Writes the manifest under a temporary name first, so an interrupted
+    write keeps the previous one
+    '''
+    with open(f'{path}.part', 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(f'{path}.part', path)
+
+
+def is_current(entry: Optional[dict], digest: str, settings: dict) -> bool:
+    '''
+    Whether the manifest entry was written for the same content and settings
+    and its output is still in place
+    '''
+    return (
+        entry is not None and entry['hash'] == digest and entry['settings'] == settings and
+        os.path.exists(entry['output']) and
+        os.path.getsize(entry['output']) == entry['output_size']
+    )
+
+
+def colliding_sources(sources: Iterable[str]) -> dict:
+    '''
+    Returns the sources that would be converted into the same container
+    file as another source (a.png and a.jpg both into a.bzbi), mapped to
+    that file
+    '''
+    by_output = defaultdict(list)
+    for path in sources:
+        by_output[output_path(path)].append(path)
+    return {
+        path: output for output, paths in by_output.items() if len(paths) > 1 for path in paths
+    }
+
+
+def convert_file(path: str, settings: dict, workers: int=1, entry: Optional[dict]=None) -> dict:
+    '''
+    Converts the file with the settings unless the manifest entry shows it
+    is up to date (in a pool process). Returns the new manifest entry with
+    the outcome: 'converted', 'skipped' or 'failed' with the error
+    '''
+    digest = content_hash(path)
+    if is_current(entry, digest, settings):
+        return dict(entry, status='skipped')
+
+    start = perf_counter()
+    try:
+        converter = Convert(
+            path, settings['codec'], settings['level'], workers,
+            settings['keyframe_interval'], settings['planar'],
+            settings.get('policy', RATIO), settings.get('time_budget', DEFAULT_TIME_BUDGET)
+        )
+        converter.save()
+    except Exception as error:
+        return {'status': 'failed', 'error': f'{type(error).__name__}: {error}'}
+    output = converter.output_path()
+    return {
+        'status': 'converted', 'hash': digest, 'settings': settings,
+        'output': output, 'output_size': os.path.getsize(output),
+        'seconds': perf_counter() - start,
+    }
+
+
+def convert_batch(
+        inputs: Iterable[str], codec: str='lz77', level: int=DEFAULT_LEVEL, jobs: int=1,
+        workers: int=1, keyframe_interval: int=DEFAULT_KEYFRAME_INTERVAL, planar: bool=False,
+        manifest_path: str=DEFAULT_MANIFEST, force: bool=False, policy: str=RATIO,
+        time_budget: float=DEFAULT_TIME_BUDGET
+    ) -> dict:
+    '''
+    Converts all supported files of the inputs on a pool of jobs processes,
+    each file with the given number of workers. Files up to date in the
+    manifest are skipped unless force is set. Files that would be written
+    into the same container file are not converted and count as failed.
+    policy and time_budget are used by the auto codec. Returns the totals:
+    numbers of converted, skipped and failed files, bytes read and written,
+    seconds
+    '''
+    # everything that changes the output
+    settings = {
+        'codec': codec.lower(), 'level': level,
+        'keyframe_interval': keyframe_interval, 'planar': planar,
+    }
+    if settings['codec'] == AUTO:
+        settings.update(policy=policy, time_budget=time_budget)
+    sources = sorted(find_sources(inputs), key=os.path.getsize, reverse=True)
+    manifest = load_manifest(manifest_path)
+    totals = {
+        'converted': 0, 'skipped': 0, 'failed': 0,
+        'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.,
+    }
+
+    start = perf_counter()
+    colliding = colliding_sources(sources)
+    for path, output in colliding.items():
+        print(f'{path}: another file is converted into {output} as well', file=sys.stderr)
+    totals['failed'] += len(colliding)
+    sources = [path for path in sources if path not in colliding]
+    job = metrics.collect(convert_file)
+    with ProcessPoolExecutor(max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(
+                job, path, settings, workers, None if force else manifest.get(path)
+            ): path
+            for path in sources
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            result = metrics.unwrap(future.result())
+            status = result.pop('status')
+            totals[status] += 1
+            if status == 'failed':
+                print(f'{path}: {result["error"]}', file=sys.stderr)
+                continue
+            if status == 'converted':
+                totals['bytes_in'] += os.path.getsize(path)
+                totals['bytes_out'] += result['output_size']
+                print(f'{path} -> {result["output"]} ({result["seconds"]:.2f} s)')
+            manifest[path] = result
+    totals['seconds'] = perf_counter() - start
+
+    save_manifest(manifest_path, manifest)
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert files and directories into custom codec'
+    )
+    parser.add_argument('inputs', nargs='+', help='files, directories or glob patterns')
+    parser.add_argument('--codec', default='lz77', choices=[*CODECS, AUTO])
+    parser.add_argument(
+        '--level', type=int, default=DEFAULT_LEVEL, choices=COMPRESSION_LEVELS,
+        help='lz77 and deflate compression level: 1 is fastest, 9 compresses best'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=os.cpu_count(), help='number of files converted at once'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of processes compressing frames and packets of every file'
+    )
+    parser.add_argument(
+        '--keyframe-interval', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+        help='distance between video frames stored as is'
+    )
+    parser.add_argument('--planar', action='store_true', help='filter image channels separately')
+    parser.add_argument(
+        '--manifest', default=DEFAULT_MANIFEST,
+        help='file recording converted files, unchanged ones are skipped'
+    )
+    parser.add_argument('--force', action='store_true', help='convert up to date files as well')
+    parser.add_argument(
+        '--policy', default=RATIO, choices=POLICIES,
+        help='how auto picks codecs: best ratio, fastest decoding or best ratio in the time budget'
+    )
+    parser.add_argument(
+        '--time-budget', type=float, default=DEFAULT_TIME_BUDGET,
+        help='seconds to compress and decompress a megabyte under the budget policy'
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.enable_from(args)
+    totals = convert_batch(
+        args.inputs, args.codec, args.level, args.jobs, args.workers,
+        args.keyframe_interval, args.planar, args.manifest, args.force,
+        args.policy, args.time_budget
+    )
+    print(
+        f"converted {totals['converted']}, skipped {totals['skipped']}, "
+        f"failed {totals['failed']} in {totals['seconds']:.2f} s"
+    )
+    if totals['converted']:
+        print(
+            f"{totals['bytes_in'] / (1 << 20) / totals['seconds']:.2f} MB/s of input, "
+            f"output {totals['bytes_in'] / max(totals['bytes_out'], 1):.2f}x smaller"
+        )
+    metrics.output(args)
+    if totals['failed']:
+        sys.exit(1)
@@ -0,0 +1,298 @@
+'''
+Benchmark of the codecs on synthetic data and the bundled examples.
+
+Every input is a list of packets prepared the way convert.py prepares them
+(filtered images, inter frames of the video, decorrelated audio samples).
+Each codec compresses and decompresses every packet; the benchmark reports
+encode and decode speed (MB/s of raw data), compression ratio and peak
+memory of Python and numpy allocations.
+
+Results can be written to JSON and compared with an earlier run:
+
+    python3 src/benchmark.py --output results.json
+    python3 src/benchmark.py --baseline results.json
+
+A run is flagged when a ratio drops, or speed drops or memory grows by more
+than the tolerance (timings of small inputs are noisy).
+'''
+
+import os
+import sys
+import json
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+from time import perf_counter
+from typing import Callable, Dict, List
+from container import encode_payload, decode_payload
+from filters import filter_image
+from audio import encode_samples, choose_stages, to_symbols, from_symbols
+from registry import get_codec, CODECS, DEFAULT_LEVEL
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_FRAMES = 10
+# raw bytes of an input taken at most, pure Python codecs are slow on megabytes
+DEFAULT_LIMIT = 1 << 18
+MB = 1 << 20
+
+
+def synthetic_random(limit: int) -> List[np.array]:
+    '''
+    Uniformly random bytes, incompressible
+    '''
+    return [np.random.default_rng(0).integers(0, 256, limit, dtype='uint8')]
+
+
+def synthetic_runs(limit: int) -> List[np.array]:
+    '''
+    Runs of random length of a few values, as in flat areas of graphics
+    '''
+    rng = np.random.default_rng(0)
+    values = rng.choice(np.arange(0, 256, 32, dtype='uint8'), limit)
+    return [np.repeat(values, rng.integers(1, 64, limit))[:limit]]
+
+
+def synthetic_sine(limit: int) -> List[np.array]:
+    '''
+    Stereo int16 sine tones in packets of half a second of 44.1 kHz audio
+    '''
+    samples = np.arange(limit // 4)
+    stereo = np.stack([np.sin(samples / 20) * 8000, np.sin(samples / 33) * 6000], axis=1)
+    return audio_packets(stereo.astype('int16').ravel(), 2, 44100)
+
+
+def text(limit: int) -> List[np.array]:
+    with open(os.path.join(EXAMPLES, 'text.txt'), 'rb') as file:
+        return [np.frombuffer(file.read(limit), dtype='uint8')]
+
+
+def image(limit: int) -> List[np.array]:
+    from PIL import Image
+    img = Image.open(os.path.join(EXAMPLES, 'image.png')).convert('RGB')
+    return [filter_image(np.array(img, dtype='uint8'))[:limit]]
+
+
+def video(limit: int, frames: int=DEFAULT_FRAMES) -> List[np.array]:
+    from moviepy.editor import VideoFileClip
+    from convert import inter_frames, DEFAULT_KEYFRAME_INTERVAL
+    clip = VideoFileClip(os.path.join(EXAMPLES, 'mouse.mov'))
+    try:
+        packets, size = [], 0
+        for frame, _ in inter_frames(clip.iter_frames(dtype='uint8'), DEFAULT_KEYFRAME_INTERVAL):
+            if len(packets) == frames or size >= limit:
+                break
+            packets.append(frame.ravel())
+            size += frame.nbytes
+        return packets
+    finally:
+        clip.close()
+
+
+def audio(limit: int) -> List[np.array]:
+    from pydub import AudioSegment
+    sound = AudioSegment.from_file(os.path.join(EXAMPLES, 'audio.mp3'), format='mp3')
+    raw = np.array(sound.get_array_of_samples(), dtype='int16')[:limit // 2]
+    return audio_packets(raw, sound.channels, sound.frame_rate)
+
+
+def audio_packets(raw: np.array, channels: int, rate: int) -> List[np.array]:
+    '''
+    Splits interleaved samples into decorrelated packets as convert.py does
+    '''
+    stages = choose_stages(raw, channels)
+    size = int(rate / (2 * channels)) * channels
+    return [
+        encode_samples(raw[start:start + size], channels, stages)
+        for start in range(0, len(raw), size)
+    ]
+
+
+INPUTS: Dict[str, Callable] = {
+    'random': synthetic_random,
+    'runs': synthetic_runs,
+    'sine': synthetic_sine,
+    'text': text,
+    'image': image,
+    'video': video,
+    'audio': audio,
+}
+
+
+def encode_packet(codec: str, packet: np.array, level: int=DEFAULT_LEVEL) -> bytes:
+    '''
+    Compresses the packet into a container payload as convert.py does
+    '''
+    if get_codec(codec).nonnegative and packet.dtype == np.int16:
+        packet = to_symbols(packet)
+    return encode_payload(codec, packet, level)
+
+
+def decode_packet(codec: str, payload: bytes, dtype: np.dtype) -> np.array:
+    '''
+    Decompresses a payload of encode_packet
+    '''
+    decompressed = decode_payload(codec, payload)
+    if get_codec(codec).nonnegative and dtype == np.int16:
+        return from_symbols(decompressed)
+    return decompressed
+
+
+def timed(func: Callable, repeat: int) -> tuple:
+    '''
+    Returns the result of func and the shortest of repeat runs in seconds
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        best = min(best, perf_counter() - start)
+    return result, best
+
+
+def peak_memory(func: Callable) -> int:
+    '''
+    Returns the peak of memory allocated while func runs, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(
+        codec: str, packets: List[np.array], repeat: int=DEFAULT_REPEAT, level: int=DEFAULT_LEVEL
+    ) -> dict:
+    '''
+    Compresses and decompresses every packet with the codec, checks the
+    round trip and returns sizes, speed and peak memory
+    '''
+    encode = lambda: [encode_packet(codec, packet, level) for packet in packets]
+    payloads, encode_time = timed(encode, repeat)
+    decode = lambda: [
+        decode_packet(codec, payload, packet.dtype) for payload, packet in zip(payloads, packets)
+    ]
+    decoded, decode_time = timed(decode, repeat)
+    for packet, packet_decoded in zip(packets, decoded):
+        if not np.array_equal(np.asarray(packet_decoded).ravel(), packet):
+            raise AssertionError(f'{codec} does not restore the data')
+
+    raw_size = sum(packet.nbytes for packet in packets)
+    compressed_size = sum(len(payload) for payload in payloads)
+    return {
+        'codec': codec,
+        'packets': len(packets),
+        'raw_bytes': raw_size,
+        'compressed_bytes': compressed_size,
+        'ratio': raw_size / max(compressed_size, 1),
+        'encode_mb_s': raw_size / MB / max(encode_time, 1e-9),
+        'decode_mb_s': raw_size / MB / max(decode_time, 1e-9),
+        'encode_peak_mb': peak_memory(encode) / MB,
+        'decode_peak_mb': peak_memory(decode) / MB,
+    }
+
+
+def run(
+        inputs=tuple(INPUTS), codecs=tuple(CODECS), repeat: int=DEFAULT_REPEAT,
+        level: int=DEFAULT_LEVEL, limit: int=DEFAULT_LIMIT
+    ) -> dict:
+    '''
+    Benchmarks every codec on every input. Inputs that cannot be loaded
+    (no ffmpeg for the examples) are skipped with a message
+    '''
+    results = []
+    for name in inputs:
+        try:
+            packets = INPUTS[name](limit)
+        except Exception as error:
+            print(f'Skipping {name}: {error}', file=sys.stderr)
+            continue
+        for codec in codecs:
+            results.append({'input': name, **benchmark(codec, packets, repeat, level)})
+    return {
+        'environment': {
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count(),
+        },
+        'settings': {'repeat': repeat, 'level': level, 'limit': limit},
+        'results': results,
+    }
+
+
+def regressions(report: dict, baseline: dict, tolerance: float=DEFAULT_TOLERANCE) -> List[str]:
+    '''
+    Returns descriptions of results worse than the same input and codec in
+    the baseline: any smaller ratio, speed lower or memory higher by more
+    than the tolerance
+    '''
+    previous = {(result['input'], result['codec']): result for result in baseline['results']}
+    found = []
+    for result in report['results']:
+        old = previous.get((result['input'], result['codec']))
+        if old is None:
+            continue
+        name = f"{result['input']} {result['codec']}"
+        if result['ratio'] < old['ratio'] * (1 - 1e-3):
+            found.append(f"{name}: ratio {old['ratio']:.3f} -> {result['ratio']:.3f}")
+        for field in ('encode_mb_s', 'decode_mb_s'):
+            if result[field] < old[field] * (1 - tolerance):
+                found.append(f'{name}: {field} {old[field]:.3f} -> {result[field]:.3f}')
+        for field in ('encode_peak_mb', 'decode_peak_mb'):
+            if result[field] > old[field] * (1 + tolerance):
+                found.append(f'{name}: {field} {old[field]:.2f} -> {result[field]:.2f}')
+    return found
+
+
+def print_table(report: dict) -> None:
+    columns = (
+        ('input', 'input', '8'), ('codec', 'codec', '8'), ('raw_bytes', 'raw KB', '9.1f'),
+        ('ratio', 'ratio', '7.3f'), ('encode_mb_s', 'enc MB/s', '9.3f'),
+        ('decode_mb_s', 'dec MB/s', '9.3f'), ('encode_peak_mb', 'enc MB', '8.2f'),
+        ('decode_peak_mb', 'dec MB', '8.2f'),
+    )
+    print(' '.join(f'{title:>{spec.split(".")[0]}}' for _, title, spec in columns))
+    for result in report['results']:
+        row = dict(result, raw_bytes=result['raw_bytes'] / 1024)
+        print(' '.join(f'{row[field]:>{spec}}' for field, _, spec in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the BzB codecs')
+    parser.add_argument('--inputs', nargs='+', choices=INPUTS, default=list(INPUTS))
+    parser.add_argument('--codecs', nargs='+', choices=CODECS, default=list(CODECS))
+    parser.add_argument(
+        '--repeat', type=int, default=DEFAULT_REPEAT, help='timed runs, the best is reported'
+    )
+    parser.add_argument(
+        '--level', type=int, default=DEFAULT_LEVEL, help='lz77 and deflate compression level'
+    )
+    parser.add_argument(
+        '--limit', type=int, default=DEFAULT_LIMIT, help='max raw bytes of every input'
+    )
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help='relative drop of speed (or growth of memory) reported as a regression'
+    )
+    args = parser.parse_args()
+
+    report = run(args.inputs, args.codecs, args.repeat, args.level, args.limit)
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['settings'] != report['settings']:
+            print(f"Baseline was run with other settings: {baseline['settings']}")
+        found = regressions(report, baseline, args.tolerance)
+        for regression in found:
+            print(f'Regression: {regression}')
+        if found:
+            sys.exit(1)
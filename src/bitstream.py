@@ -0,0 +1,87 @@
+'''
+Helpers for packing variable-length codes into bit buffers and back.
+'''
+
+import numpy as np
+from typing import Tuple
+
+# number of codes packed at once, bounds the temporary bit-per-byte buffer
+PACK_CHUNK_SIZE = 1 << 20
+
+
+def pack_codes(codes: np.array, lengths: np.array) -> Tuple[np.array, int]:
+    '''
+    Packs codes of the given bit lengths (most significant bit first) into
+    a uint8 buffer. Returns the buffer and the number of meaningful bits.
+    '''
+    codes = np.asarray(codes, dtype='uint64')
+    lengths = np.asarray(lengths, dtype='int64')
+
+    packed_parts = []
+    carry = np.zeros(0, dtype='uint8')
+    for start in range(0, len(codes), PACK_CHUNK_SIZE):
+        chunk_codes = codes[start:start + PACK_CHUNK_SIZE]
+        chunk_lengths = lengths[start:start + PACK_CHUNK_SIZE]
+
+        ends = np.cumsum(chunk_lengths) + len(carry)
+        bits = np.zeros(len(carry) + int(chunk_lengths.sum()), dtype='uint8')
+        bits[:len(carry)] = carry
+        for shift in range(int(chunk_lengths.max(initial=0))):
+            has_bit = np.flatnonzero(chunk_lengths > shift)
+            bits[ends[has_bit] - 1 - shift] = (
+                chunk_codes[has_bit] >> np.uint64(shift)
+            ) & np.uint64(1)
+
+        # only whole bytes are packed, the rest waits for the next chunk
+        whole = len(bits) - len(bits) % 8
+        packed_parts.append(np.packbits(bits[:whole]))
+        carry = bits[whole:]
+
+    packed_parts.append(np.packbits(carry))
+    bit_length = int(lengths.sum())
+    return np.concatenate(packed_parts), bit_length
+
+
+def unpack_bits(packed: np.array, bit_length: int) -> np.array:
+    '''
+    Returns the first bit_length bits of the packed buffer, one per byte.
+    '''
+    return np.unpackbits(np.frombuffer(packed, dtype='uint8'), count=bit_length)
+
+
+def unpack_codes(packed: np.array, lengths: np.array) -> np.array:
+    '''
+    Reads consecutive codes of the given bit lengths (most significant bit
+    first) from the packed buffer.
+    '''
+    packed = np.frombuffer(packed, dtype='uint8')
+    lengths = np.asarray(lengths, dtype='int64')
+    codes = np.zeros(len(lengths), dtype='uint64')
+
+    bit_start = 0
+    for start in range(0, len(lengths), PACK_CHUNK_SIZE):
+        chunk_lengths = lengths[start:start + PACK_CHUNK_SIZE]
+        chunk_bit_length = int(chunk_lengths.sum())
+        first_byte = bit_start >> 3
+        bits = np.unpackbits(
+            packed[first_byte:(bit_start + chunk_bit_length + 7) >> 3]
+        )[bit_start - first_byte * 8:]
+
+        positions = np.cumsum(chunk_lengths) - chunk_lengths
+        chunk_codes = codes[start:start + PACK_CHUNK_SIZE]
+        for shift in range(int(chunk_lengths.max(initial=0))):
+            has_bit = np.flatnonzero(chunk_lengths > shift)
+            chunk_codes[has_bit] = chunk_codes[has_bit] << np.uint64(1) | bits[positions[has_bit] + shift]
+        bit_start += chunk_bit_length
+    return codes
+
+
+def bit_lengths(values: np.array) -> np.array:
+    '''
+    Returns the number of bits needed to write every (non-negative) value.
+    '''
+    values = np.asarray(values, dtype='int64')
+    res = np.zeros(len(values), dtype='int64')
+    positive = values > 0
+    res[positive] = np.floor(np.log2(values[positive])).astype('int64') + 1
+    return res
@@ -0,0 +1,296 @@
+'''
+Container of .bzbi, .bzbv and .bzba files.
+
+A file starts with a fixed header followed by JSON metadata (media type,
+codec, shape, rate and media specific fields), then payloads of packets
+(one per image, video frame or audio package) and an index of packets at
+the end:
+
+    header | metadata | packet 0 | packet 1 | ... | index
+
+The index holds offset, size, flags and codec of every packet, so the
+reader maps the file into memory and reads only the packets asked for.
+Payloads that zlib makes smaller are stored compressed (store_payload)
+and marked with the ZLIB flag, the reader inflates them when the packet
+is read. The codecs
+leave redundancy (fixed width lz77 tokens and lzw codes) that zlib removes,
+with lz77 the example image and mouse.mov take a third of the space.
+Unlike the np.savez_compressed archives of older versions, zlib does not
+see across packets, so videos are still larger than they were then.
+Codecs of packets are positions in the 'codecs' list of the metadata, so
+packets of one file can use different codecs. Version 1 indexes have no
+codec, all their packets use the codec of the metadata. Files written by
+older versions (np.savez_compressed archives) are read through the same
+interface.
+'''
+
+import os
+import json
+import mmap
+import struct
+import zlib
+import numpy as np
+from typing import Optional
+from registry import get_codec
+import metrics
+
+# magic, version, metadata size, index offset, number of packets
+HEADER = struct.Struct('<4sHIQQ')
+MAGIC = b'BZBC'
+VERSION = 3
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('flags', '<u4'), ('codec', 'u1')])
+INDEX_ENTRY = struct.Struct('<QIIB')
+# index entries by version
+INDEX_DTYPES = {
+    1: np.dtype([('offset', '<u8'), ('size', '<u4'), ('flags', '<u4')]),
+    2: INDEX_DTYPE,
+    3: INDEX_DTYPE,
+}
+# packet can be decoded without the previous ones
+KEYFRAME = 1
+# payload is stored compressed with zlib (since version 3)
+ZLIB = 2
+# zlib level of stored payloads
+ZLIB_LEVEL = 6
+# magic of zip archives written by np.savez_compressed
+LEGACY_MAGIC = b'PK'
+
+
+def encode_payload(codec: str, data: np.array, level: int) -> bytes:
+    '''
+    Compresses the array with the codec into packet payload, level is
+    ignored by codecs without levels
+    '''
+    return get_codec(codec).encode(data, level)
+
+
+def decode_payload(codec: str, payload) -> np.array:
+    '''
+    Decompresses packet payload, either bytes written by encode_payload or
+    codec output stored by older versions
+    '''
+    metrics.count('decode.packets')
+    with metrics.timer('decode'):
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            return decode_legacy_payload(codec, payload)
+        return get_codec(codec).decode(payload)
+
+
+def store_payload(payload: bytes) -> tuple:
+    '''
+    Returns (stored payload, flags): the payload compressed with zlib and
+    the ZLIB flag if that is smaller, else the payload as it is
+    '''
+    with metrics.timer('zlib'):
+        compressed = zlib.compress(payload, ZLIB_LEVEL)
+    if len(compressed) < len(payload):
+        return compressed, ZLIB
+    return payload, 0
+
+
+def decode_legacy_payload(codec: str, payload) -> np.array:
+    '''
+    Decompresses codec output stored in np.savez_compressed archives
+    '''
+    return get_codec(codec).decode_legacy(payload)
+
+
+class ContainerWriter:
+    '''
+    Writes packets into a container file as they come, keeping only their
+    index entries in memory. The index is written and the header completed
+    on close(). Until then the file is written under a temporary name, so an
+    interrupted conversion does not leave an incomplete file behind.
+    '''
+
+    def __init__(self, path: str, metadata: dict) -> None:
+        self.path = path
+        self.temporary_path = f'{path}.part'
+        metadata = dict(metadata)
+        metadata.setdefault('codecs', [metadata['codec']])
+        self.metadata = metadata
+        self.file = open(self.temporary_path, 'wb')
+        metadata_bytes = json.dumps(metadata).encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(metadata_bytes), 0, 0))
+        self.file.write(metadata_bytes)
+        self.metadata_size = len(metadata_bytes)
+        self.position = HEADER.size + self.metadata_size
+        self.index = bytearray()
+        self.packets_num = 0
+
+    def write_packet(self, payload: bytes, flags: int=KEYFRAME, codec: Optional[str]=None) -> None:
+        '''
+        Appends the packet payload to the file, codec is one of the codecs
+        of the metadata (the first one by default). Flags include ZLIB if
+        the payload was stored by store_payload compressed
+        '''
+        codec_index = 0 if codec is None else self.metadata['codecs'].index(codec)
+        self.file.write(payload)
+        self.index += INDEX_ENTRY.pack(self.position, len(payload), flags, codec_index)
+        self.packets_num += 1
+        self.position += len(payload)
+
+    def close(self) -> None:
+        '''
+        Writes the index, completes the header and moves the file in place
+        '''
+        if self.file.closed:
+            return
+        self.file.write(self.index)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, self.metadata_size, self.position, self.packets_num
+        ))
+        self.file.close()
+        os.replace(self.temporary_path, self.path)
+
+    def abort(self) -> None:
+        '''
+        Discards the file written so far
+        '''
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temporary_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ContainerReader:
+    '''
+    Reads packets of a container file mapped into memory
+
+    Attributes
+    ----------
+    metadata: dict
+        media type, codec, shape, rate and media specific fields
+    index: np.array
+        offset, size, flags and codec of every packet
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, metadata_size, index_offset, packets_num = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a BzB container')
+        if version > VERSION:
+            raise ValueError(f'{path} was written by a newer version of the container')
+        if index_offset == 0:
+            raise ValueError(f'{path} was not completely written')
+        self.metadata = json.loads(self.buffer[HEADER.size:HEADER.size + metadata_size])
+        self.metadata.setdefault('codecs', [self.metadata['codec']])
+        index = np.frombuffer(
+            self.buffer, dtype=INDEX_DTYPES[version], count=packets_num, offset=index_offset
+        )
+        self.index = np.zeros(packets_num, dtype=INDEX_DTYPE)
+        for name in index.dtype.names:
+            self.index[name] = index[name]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def packet(self, number: int) -> bytes:
+        '''
+        Returns payload of the packet, inflated if it is stored compressed
+        '''
+        offset, size, flags = self.index[number][['offset', 'size', 'flags']].tolist()
+        if flags & ZLIB:
+            with metrics.timer('zlib'):
+                return zlib.decompress(self.buffer[offset:offset + size])
+        return self.buffer[offset:offset + size]
+
+    def codec(self, number: int) -> str:
+        '''
+        Returns the name of the codec of the packet
+        '''
+        return self.metadata['codecs'][self.index['codec'][number]]
+
+    def is_keyframe(self, number: int) -> bool:
+        return bool(self.index['flags'][number] & KEYFRAME)
+
+    def keyframe_before(self, number: int) -> int:
+        '''
+        Returns the number of the last keyframe not after the packet,
+        decoding of the packet starts there
+        '''
+        keyframes = np.flatnonzero(self.index['flags'][:number + 1] & KEYFRAME)
+        if len(keyframes) == 0:
+            raise ValueError(f'No keyframe before packet {number}')
+        return int(keyframes[-1])
+
+    def read(self, number: int) -> np.array:
+        '''
+        Returns decompressed data of the packet
+        '''
+        return decode_payload(self.codec(number), self.packet(number))
+
+    def close(self) -> None:
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class LegacyReader(ContainerReader):
+    '''
+    Reads np.savez_compressed archives written by older versions with the
+    interface of ContainerReader. The whole archive is loaded at once.
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        info = np.load(path, allow_pickle=True)['info']
+        packets, media_info = info[0], info[1]
+        if path.endswith('bzbi'):
+            self.packets = [packets]
+            codec = info[2] if len(info) > 2 else 'lz77'
+            self.metadata = {
+                'media': 'image', 'codec': codec, 'shape': np.asarray(media_info).tolist()
+            }
+        elif path.endswith('bzbv'):
+            self.packets = list(packets)
+            media_info = np.asarray(media_info).astype(int).tolist()
+            self.metadata = {
+                'media': 'video', 'codec': 'lz77',
+                'rate': media_info[0], 'shape': media_info[1:4],
+            }
+        else:
+            self.packets = list(packets)
+            peak, channels, rate, packet_size, duration, *codec = media_info
+            self.metadata = {
+                'media': 'audio', 'codec': codec[0] if codec else 'lz77',
+                'rate': int(rate), 'channels': int(channels), 'peak': int(peak),
+                'packet_size': int(packet_size), 'duration': float(duration),
+            }
+        self.metadata['codecs'] = [self.metadata['codec']]
+        self.index = np.zeros(len(self.packets), dtype=INDEX_DTYPE)
+        self.index['flags'] = KEYFRAME
+
+    def packet(self, number: int):
+        return self.packets[number]
+
+    def close(self) -> None:
+        self.packets = []
+
+
+def open_container(path: str) -> ContainerReader:
+    '''
+    Opens a container file or an archive written by older versions
+    '''
+    with open(path, 'rb') as file:
+        magic = file.read(len(LEGACY_MAGIC))
+    if magic == LEGACY_MAGIC:
+        return LegacyReader(path)
+    return ContainerReader(path)
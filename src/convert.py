@@ -2,16 +2,61 @@
 Module for converting files into custom codec using compression algos
 '''
 
-import sys
+import argparse
 import numpy as np
-from PIL import Image
-from moviepy.editor import VideoFileClip
-from pydub import AudioSegment
 import os
-from lzw import lzw_compress, lzw_decompress
-from Huffman_algo import HuffmanCode
-from lz77 import compress
-from deflate import Deflate
+from typing import Optional
+from container import ContainerWriter, store_payload, KEYFRAME
+from pipeline import ordered_map
+from filters import filter_image
+from audio import encode_samples, choose_stages, to_symbols
+from registry import get_codec, media_of, CODECS, DEFAULT_LEVEL, COMPRESSION_LEVELS
+from selection import choose_codec, RATIO, POLICIES, DEFAULT_TIME_BUDGET, DEFAULT_SAMPLE_SIZE
+import metrics
+
+# distance between video frames stored as is
+DEFAULT_KEYFRAME_INTERVAL = 60
+# codec name choosing a codec for every packet
+AUTO = 'auto'
+
+
+def output_path(path: str) -> str:
+    '''
+    Path of the container file of the source file: the path with the
+    extension of its media
+    '''
+    return f'{os.path.splitext(path)[0]}.{media_of(path).extension}'
+
+
+def value_changes(arr: np.array) -> int:
+    '''
+    Number of neighbouring elements that differ, an estimate of how many
+    runs and matches the codecs need for the array
+    '''
+    flat = arr.ravel()
+    return int(np.count_nonzero(flat[1:] != flat[:-1]))
+
+
+def inter_frames(frames, keyframe_interval: int):
+    '''
+    Yields (frame, flags): keyframes as they are and other frames as xor with
+    the previous frame. A frame is a keyframe every keyframe_interval frames
+    or whenever its xor with the previous frame looks harder to compress
+    than the frame itself (scene changes, noisy frames).
+    '''
+    previous = None
+    since_keyframe = 0
+    for frame in frames:
+        if previous is not None and since_keyframe < keyframe_interval:
+            residual = np.bitwise_xor(frame, previous)
+            if value_changes(residual) < value_changes(frame):
+                since_keyframe += 1
+                previous = frame
+                yield residual, 0
+                continue
+        since_keyframe = 1
+        previous = frame
+        yield frame, KEYFRAME
 
 
 class Convert:
@@ -24,6 +69,20 @@ class Convert:
     path: str
         path to the file that will be encoded.
         Raises TypeError if path is invalid
+    level: int
+        compression level (1-9) of lz77 and deflate
+    workers: int
+        number of processes compressing video frames and audio packets
+    keyframe_interval: int
+        max distance between video frames stored as is (keyframes),
+        1 makes every frame a keyframe
+    planar: bool
+        whether image filters work on separate channel planes
+    policy: str
+        how the auto codec picks the codec of every packet: 'ratio',
+        'decode' or 'budget'
+    time_budget: float
+        seconds to compress and decompress a megabyte under the budget policy
 
     Methods
     -------
@@ -35,160 +94,245 @@ class Convert:
         compresses the video and creates encoded file
     save_audio()
         compresses the audio and creates encoded file
+    output_path()
+        path of the encoded file
     save()
         compresses any given file or raises the error if it is unsupported
     '''
-    def __init__(self, path: str, compression_type='lz77'):
+    def __init__(
+            self, path: str, compression_type='lz77', level: int=DEFAULT_LEVEL, workers: int=1,
+            keyframe_interval: int=DEFAULT_KEYFRAME_INTERVAL, planar: bool=False,
+            policy: str=RATIO, time_budget: float=DEFAULT_TIME_BUDGET
+        ):
         if not os.path.exists(path):
             raise TypeError('You must provide a valid path')
 
         self.path = path
+        self.level = level
+        self.workers = workers
+        if keyframe_interval < 1:
+            raise ValueError('Keyframe interval must be positive')
+        self.keyframe_interval = keyframe_interval
+        self.planar = planar
+        if policy not in POLICIES:
+            raise ValueError(f'Codec selection policy must be one of {POLICIES}')
+        self.policy = policy
+        self.time_budget = time_budget
         self.compress = self.compresssion(compression_type)
         self.compresssion_type = compression_type
-    
+        # candidates of every packet
+        self.codecs = list(CODECS.values()) if self.compress is None else [self.compress]
 
     def compresssion(self, compression_type):
-        if compression_type.lower() == 'lz77':
-            return compress
-        if compression_type.lower() == 'lzw':
-            return lzw_compress
-        if compression_type.lower() == 'deflate':
-            return Deflate().encode
-        if 'huffman' in compression_type.lower():
-            return HuffmanCode
-        raise ValueError('Unsupported compression. One of the following is supported:\
- lz77, lzw, huffman, deflate')
+        '''
+        Returns the registered codec, its module is imported on first use,
+        None for auto
+        '''
+        if compression_type.lower() == AUTO:
+            return None
+        return get_codec(compression_type)
+
+    @property
+    def codec_name(self) -> str:
+        return AUTO if self.compress is None else self.compress.name
 
     def _convert_img(self, image) -> tuple:
         '''
-        Private method for converting image into numpy array
+        Private method for converting image into numpy array,
+        filtered before compression
         '''
         arr = np.array(image, dtype='uint8')
-        shape = np.array(arr.shape, dtype='uint16')
+        with metrics.timer('filter'):
+            filtered = filter_image(arr, self.planar)
+        # an image is a single packet, auto tries every codec on all of it
+        return self.compress_packet(filtered, None), list(arr.shape)
 
-        if self.compress == HuffmanCode:
-            flat_arr = self.compress(arr.ravel()).encode()
-            flat_arr = np.array([flat_arr[0], flat_arr[1]])
-        else:
-            flat_arr = self.compress(arr.ravel())
+    def encode_with(self, codec, arr: np.array) -> bytes:
+        '''
+        Compresses the array with the codec, signed audio residuals are
+        shifted for codecs taking non-negative symbols
+        '''
+        if codec.nonnegative and arr.dtype == np.int16:
+            arr = to_symbols(arr)
+        return codec.encode(arr.ravel(), self.level)
 
-        return flat_arr, shape
+    def compress_packet(
+            self, arr: np.array, sample_size: Optional[int]=DEFAULT_SAMPLE_SIZE
+        ) -> tuple:
+        '''
+        Compresses the array into a container packet with the codec chosen
+        for it (from a sample of sample_size bytes of large arrays, all of
+        it if None), returns (packet, codec name, flags of the stored packet)
+        '''
+        name, stored = choose_codec(
+            arr, self.codecs, self.encode_with, self.policy, self.time_budget, sample_size,
+            store_payload
+        )
+        if stored is None:
+            with metrics.timer('encode'):
+                stored = store_payload(self.encode_with(get_codec(name), arr))
+        packet, flags = stored
+        metrics.count('encode.bytes_in', arr.nbytes)
+        metrics.count('encode.bytes_out', len(packet))
+        return packet, name, flags
+
+    def compress_frame(self, frame_and_flags: tuple) -> tuple:
+        '''
+        Compresses a video frame (or its difference from the previous one)
+        into a container packet, returns (packet, codec name, flags)
+        '''
+        frame, flags = frame_and_flags
+        packet, codec, stored_flags = self.compress_packet(frame)
+        return packet, codec, flags | stored_flags
+
+    def compress_audio_packet(self, package: tuple) -> tuple:
+        '''
+        Decorrelates (interleaved int16 samples, channels, stages) and
+        compresses them into a container packet, returns (packet, codec name, flags)
+        '''
+        samples, channels, stages = package
+        with metrics.timer('audio.decorrelate'):
+            residuals = encode_samples(samples, channels, stages)
+        return self.compress_packet(residuals)
 
     def save_img(self):
         '''
         compresses the image and creates encoded file
         '''
-        img = Image.open(self.path).convert('RGB')
-        
-        arr, shape = self._convert_img(img)
-        img_info = np.array([arr, shape, self.compresssion_type])
-
-        np.savez_compressed(f'{self.path[:-3]}bzbi', info=img_info)
-        self.bzb_extension('img')
+        from PIL import Image
+        with metrics.timer('io.read'):
+            img = Image.open(self.path).convert('RGB')
+
+        (packet, codec, flags), shape = self._convert_img(img)
+        # the single packet of an image records the codec auto chose for it
+        metadata = {
+            'media': 'image', 'codec': codec, 'shape': shape,
+            'filters': 'planar' if self.planar else 'interleaved',
+        }
+        with ContainerWriter(self.output_path(), metadata) as writer:
+            with metrics.timer('io.write'):
+                writer.write_packet(packet, KEYFRAME | flags, codec)
 
     def save_vid(self):
         '''
         compresses the video and creates encoded file
+
+        at least every keyframe_interval-th frame is a keyframe, the frames
+        in between are stored as xor with the previous one, which is mostly
+        zeros for static scenes. frames are read, compressed on a pool of
+        workers and written in order as they are ready; only a few frames per
+        worker are in flight at once, so memory use does not depend on the
+        video length
         '''
+        from moviepy.editor import VideoFileClip
         clip = VideoFileClip(self.path)
-        rate = clip.fps
-        print(f"Number of frames: {clip.reader.nframes}")
-        size = clip.size[::-1]
-        vid_info = np.array([rate, *size, 3., self.compresssion_type], dtype = np.int)
-
-        #convert frames of the video into numpy
-        frames = []
-        cnt_frame = 0
-        for frame in clip.iter_frames():
-            print(f'Current frame: {cnt_frame}', end= ' \r')
-            frame_arr = np.array(frame, dtype='uint8')
-            # #insert compression here
-            if self.compress == HuffmanCode:
-                frame_arr = self.compress(frame.ravel()).encode()[0]
-            else:
-                frame_arr = self.compress(frame.ravel())
-
-            frames.append(frame_arr)
-            cnt_frame += 1
-
-        frames = np.array(frames)
-
-        frames = np.array([frames, vid_info])
-
-        np.savez_compressed(f'{self.path[:-3]}bzbv', info=frames)
-        self.bzb_extension('vid')
+        try:
+            print(f"Number of frames: {clip.reader.nframes}")
+            metadata = {
+                'media': 'video', 'codec': self.codec_name,
+                'codecs': [codec.name for codec in self.codecs],
+                'rate': clip.fps, 'shape': [*clip.size[::-1], 3],
+                'keyframe_interval': self.keyframe_interval,
+            }
+
+            with ContainerWriter(self.output_path(), metadata) as writer:
+                packets = ordered_map(
+                    self.compress_frame,
+                    inter_frames(
+                        metrics.timed_iter('io.read', clip.iter_frames(dtype='uint8')),
+                        self.keyframe_interval
+                    ),
+                    self.workers
+                )
+                for cnt_frame, (packet, codec, flags) in enumerate(packets):
+                    print(f'Current frame: {cnt_frame}', end= ' \r')
+                    with metrics.timer('io.write'):
+                        writer.write_packet(packet, flags, codec)
+        finally:
+            clip.close()
 
     def save_audio(self):
         '''
         compresses the audio and creates encoded file
+
+        packets of samples (the last one may be shorter) are decorrelated
+        and compressed on a pool of workers
         '''
-        sound = AudioSegment.from_file(self.path, format='mp3')
-        peak_amplitude = sound.max
-        loudness = sound.dBFS
+        from pydub import AudioSegment
+        with metrics.timer('io.read'):
+            sound = AudioSegment.from_file(self.path, format='mp3')
+            raw = np.array(sound.get_array_of_samples(), dtype='int16')
         channels_cnt = sound.channels
-        raw = np.array(sound.get_array_of_samples())
         pckg_size = int(sound.frame_rate / (2 * channels_cnt))
+        stages = choose_stages(raw, channels_cnt)
+        metadata = {
+            'media': 'audio', 'codec': self.codec_name,
+            'codecs': [codec.name for codec in self.codecs],
+            'rate': sound.frame_rate, 'channels': channels_cnt, 'peak': sound.max,
+            'packet_size': pckg_size, 'duration': sound.frame_count() / sound.frame_rate,
+            'stages': list(stages),
+        }
 
-        frame_r = sound.frame_rate
-        audio_info = np.array([peak_amplitude, channels_cnt, sound.frame_rate, 
-                    pckg_size, sound.frame_count()/ sound.frame_rate, self.compresssion_type], dtype=object)
-
-
-        package = []
         size = pckg_size * channels_cnt
-        cnt = 0
-
-        while (cnt + 1) * size < len(raw):
-
-            compressed_package = np.array(raw[(cnt * size) : ((cnt + 1)*size)], dtype='int16')
-
-            compressed_package = self.compress(compressed_package)
-
-            package.append(compressed_package)
-            cnt += 1
-
-
-        
-        package = np.array(package)
-        audio = np.array([package, audio_info])
-
-        np.savez_compressed(f'{self.path[:-3]}bzba', info=audio)
-        self.bzb_extension('audio')
-
-
-    def bzb_extension(self, type):
-        if type == 'img':
-            ext = 'bzbi'
-        elif type == 'vid':
-            ext = 'bzbv'
-        else:
-            ext = 'bzba'
-        os.rename(f'{self.path[:-4]}.{ext}.npz', f'{self.path[:-4]}.{ext}')
+        packages = (
+            (raw[start:start + size], channels_cnt, stages) for start in range(0, len(raw), size)
+        )
+        with ContainerWriter(self.output_path(), metadata) as writer:
+            packets = ordered_map(self.compress_audio_packet, packages, self.workers)
+            for packet, codec, flags in packets:
+                with metrics.timer('io.write'):
+                    writer.write_packet(packet, KEYFRAME | flags, codec)
+
+    def output_path(self) -> str:
+        '''
+        Path of the container file: the path with the extension of its media
+        '''
+        return output_path(self.path)
 
-    
     def save(self):
         '''
         compresses any given file or raises the error if it is unsupported
         '''
-        if self.path.endswith('.jpg') or self.path.endswith('.png'):
-            self.save_img()
-        elif self.path.endswith('mp4') or self.path.endswith('mov'):
-            self.save_vid()
-        elif self.path.endswith('mp3'):
-            if self.compress != compress:
-                raise ValueError('lz77 is the only compression algo that supports audio')
-            self.save_audio()
-        else:
-            raise ValueError('Currently unsupported file.')
+        savers = {'image': self.save_img, 'video': self.save_vid, 'audio': self.save_audio}
+        savers[media_of(self.path).name]()
 
 if __name__ == '__main__':
 
-    if len(sys.argv) <= 1:
-        print(f"Usage: {sys.argv[0]} file codec")
-    else:
-        path = sys.argv[1]
-        try:
-            algo = sys.argv[2] 
-        except IndexError:
-            algo = 'lz77'
-        Convert(path, algo).save()
+    parser = argparse.ArgumentParser(description='Convert file into custom codec')
+    parser.add_argument('file')
+    parser.add_argument(
+        'codec', nargs='?', default='lz77',
+        help=f"{', '.join(CODECS)} or {AUTO} to choose one for every frame and packet"
+    )
+    parser.add_argument(
+        '--level', type=int, default=DEFAULT_LEVEL, choices=COMPRESSION_LEVELS,
+        help='lz77 and deflate compression level: 1 is fastest, 9 compresses best'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of processes compressing video frames and audio packets'
+    )
+    parser.add_argument(
+        '--keyframe-interval', type=int, default=DEFAULT_KEYFRAME_INTERVAL,
+        help='distance between video frames stored as is, others are stored as difference from the previous one'
+    )
+    parser.add_argument(
+        '--planar', action='store_true',
+        help='filter image channels separately, often better for photos'
+    )
+    parser.add_argument(
+        '--policy', default=RATIO, choices=POLICIES,
+        help='how auto picks codecs: best ratio, fastest decoding or best ratio in the time budget'
+    )
+    parser.add_argument(
+        '--time-budget', type=float, default=DEFAULT_TIME_BUDGET,
+        help='seconds to compress and decompress a megabyte under the budget policy'
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.enable_from(args)
+    Convert(
+        args.file, args.codec, args.level, args.workers, args.keyframe_interval, args.planar,
+        args.policy, args.time_budget
+    ).save()
+    metrics.output(args)
@@ -1,17 +1,48 @@
 import numpy as np
-import sys
-from itertools import chain
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 from lz77 import compress, decompress
-from Huffman_algo import HuffmanCode
+from registry import DEFAULT_LEVEL
+from Huffman_algo import HuffmanCode, pack_block, read_block
+import metrics
+
+# magic and dtype of the encoded values
+STREAM_HEADER = struct.Struct('<4s4s')
+MAGIC = b'BZBD'
+# block type, number of values in the block and size of the block payload in bytes
+BLOCK_HEADER = struct.Struct('<BII')
+STORED = 0
+DYNAMIC = 1
+# number of lz77 tokens in a dynamic block
+TOKENS_NUM = struct.Struct('<I')
+CHUNK_SIZE = 65535
+
 
 class Deflate:
     '''
     Simple realisation of Deflate coding algorithm, which is based on
     LZ77 and Huffman compression algos.
+
+    Chunks are coded independently, with workers > 1 they are spread over a
+    process pool. The output is the same for any number of workers.
     '''
 
-    def encode(self, data: np.array) -> np.array:
+    def __init__(self, workers: int=1):
+        self.workers = workers
+
+    def map_blocks(self, func, *iterables) -> list:
+        '''
+        Applies func to every block in order, in a process pool if there
+        are several workers and blocks
+        '''
+        iterables = [list(iterable) for iterable in iterables]
+        if self.workers <= 1 or len(iterables[0]) <= 1:
+            return list(map(func, *iterables))
+        with ProcessPoolExecutor(min(self.workers, len(iterables[0]))) as executor:
+            return list(map(metrics.unwrap, executor.map(metrics.collect(func), *iterables)))
+
+    def encode(self, data: np.array, level: int=DEFAULT_LEVEL) -> np.array:
         '''
         Encodes the data using LZ77 and Huffman codding
 
@@ -22,86 +53,139 @@ class Deflate:
             - no encoding for chunks with a little amound of redundant data
         Fixed Huffman trees were omitted as they were developed mainly for text, and
         according to our tests, they work not that fine for other types of data
+
+        Level (1-9) is the lz77 compression level of every chunk.
+
+        Returns uint8 array: a stream header with the dtype of the data followed
+        by blocks, each with a header (type, number of values, payload size)
+        and either raw values or code lengths with packed bits of both Huffman codes.
         '''
+        data = np.asarray(data).ravel()
+        value_dtype = data.dtype.newbyteorder('<')
 
+        chunks = [data[idx:idx + CHUNK_SIZE] for idx in range(0, len(data), CHUNK_SIZE)]
+        res: List[bytes] = [STREAM_HEADER.pack(MAGIC, value_dtype.str.encode())]
+        res += self.map_blocks(
+            self.encode_block, chunks, [value_dtype] * len(chunks), [level] * len(chunks)
+        )
+        return np.frombuffer(b''.join(res), dtype='uint8')
 
-        # ------ chunking the data ------
-        сhunks: List[str] = []
-        idx: int = 0
-        while idx <= len(data):
-            try:
-                сhunks.append(data[idx:idx+65535])
-            except IndexError:
-                сhunks.append(data[idx:])
-            idx += 65535
+    def encode_block(self, chunk: np.array, value_dtype: np.dtype, level: int=DEFAULT_LEVEL) -> bytes:
+        '''
+        Encodes one chunk into a block, stored as is if coding does not pay off
+        '''
+        # ---- coding via lz77 --------
+        codewords = compress(chunk, level=level)
 
-        res = []
-        for chunk in сhunks:
-            # ---- coding via lz77 --------
-            codewords = compress(chunk)
-            # print(f'During encoding {np.array(list([list(elm) for elm in codewords]))}')
-
-            # --- encodes literals_and_distances and lengths separately ----
-            literals_and_distances = [(elm[0], elm[-1]) for elm in codewords]
-            lengths = [elm[1] for elm in codewords]
-            encoded_lengths, lengths_table = HuffmanCode(lengths).encode()
-            encoded_literals_and_distances, \
-                literals_and_distances_table = HuffmanCode(list(chain(*literals_and_distances))).encode()
-            # according to the specification, for each chunk of data, encoded data
-            # should foolow its huffman dict (created separately for it)
-            encoding_type = 1
-            if len(encoded_lengths) + len(encoded_literals_and_distances) > len(chunk) * 5:
-                encoding_type = 0
-            
-            if encoding_type:
-                # if the chunk should be encoded with dynamically created huffman tree
-                encoded_chunk = (1, lengths_table, encoded_lengths,\
-                            literals_and_distances_table, encoded_literals_and_distances)
-            else: # if the chunk should not be encoded
-                encoded_chunk = (0, chunk)
-            res.append(encoded_chunk)
-            
-        ov_size: int = 0
-        # we count len because it returns list of 1 and 0, which then can be written
-        # directly in binary file via python's struct module (struct.pack())
-        for elm in res:
-            if elm[0] == 0:
-                ov_size += len(elm[1])
-            elif elm[0] == 1:
-                ov_size += len(elm[2]) + len(elm[4]) + sys.getsizeof(elm[1]) + sys.getsizeof(elm[3])
-        
-        print(f'Overall size of compression with deflate is: {ov_size}')
-    
-        return res
-    
+        # --- encodes literals_and_distances and lengths separately ----
+        literals_and_distances = np.empty(2 * len(codewords), dtype='int64')
+        literals_and_distances[0::2] = codewords['offset']
+        literals_and_distances[1::2] = codewords['value']
+        payload = b''.join([
+            TOKENS_NUM.pack(len(codewords)),
+            pack_block(*HuffmanCode(codewords['length']).encode_packed()),
+            pack_block(*HuffmanCode(literals_and_distances).encode_packed()),
+        ])
+        # according to the specification, for each chunk of data, encoded data
+        # should foolow its huffman dict (created separately for it)
+        encoding_type = DYNAMIC
+        if len(payload) >= len(chunk) * value_dtype.itemsize:
+            encoding_type = STORED
+            payload = chunk.astype(value_dtype).tobytes()
+            metrics.count('deflate.stored_blocks')
+        metrics.count('deflate.blocks')
+
+        return BLOCK_HEADER.pack(encoding_type, len(chunk), len(payload)) + payload
 
     def decode(self, compressed_data: np.array) -> np.array:
         '''
         Decodes the message, using the decode-implementation of LZ77 and Huffman.
 
-        Takes: compressed data in np.array([List[int]]) format.
+        Takes: buffer written by encode. Lists of (type, ...) tuples written
+        by older versions are decoded as well.
         '''
+        if isinstance(compressed_data, list) or np.asarray(compressed_data).dtype == object:
+            return self.decode_chunks(compressed_data)
+
+        buffer = np.frombuffer(compressed_data, dtype='uint8')
+        magic, value_dtype = STREAM_HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError('Not a deflate stream')
+        value_dtype = np.dtype(value_dtype.rstrip(b'\x00').decode())
 
+        encoding_types, values_nums, payloads = [], [], []
+        position = STREAM_HEADER.size
+        while position < len(buffer):
+            encoding_type, values_num, payload_size = BLOCK_HEADER.unpack_from(buffer, position)
+            position += BLOCK_HEADER.size
+            encoding_types.append(encoding_type)
+            values_nums.append(values_num)
+            payloads.append(buffer[position:position + payload_size])
+            position += payload_size
+
+        res = self.map_blocks(
+            self.decode_block, encoding_types, values_nums, payloads, [value_dtype] * len(payloads)
+        )
+
+        if not res:
+            return np.array([], dtype=value_dtype.newbyteorder('='))
+        return np.concatenate(res)
+
+    def decode_block(
+            self, encoding_type: int, values_num: int, payload: np.array, value_dtype: np.dtype
+        ) -> np.array:
+        '''
+        Decodes payload of one block
+        '''
+        # if the chunk was not compressed
+        if encoding_type == STORED:
+            return np.frombuffer(payload, dtype=value_dtype, count=values_num).astype(
+                value_dtype.newbyteorder('=')
+            )
+
+        # decoding huffman trees
+        (tokens_num,) = TOKENS_NUM.unpack_from(payload)
+        packed, bit_length, table, position = read_block(payload, TOKENS_NUM.size)
+        lengths = HuffmanCode(packed).decode_packed(bit_length, table)
+        packed, bit_length, table, _ = read_block(payload, position)
+        literals_and_distances = HuffmanCode(packed).decode_packed(bit_length, table)
+
+        # preparing struct for lz77 decoding
+        data_for_lz77 = np.zeros(tokens_num, dtype=[
+            ('offset', 'int64'), ('length', 'int64'),
+            ('value', value_dtype.newbyteorder('='))
+        ])
+        data_for_lz77['offset'] = literals_and_distances[0::2]
+        data_for_lz77['length'] = lengths
+        data_for_lz77['value'] = literals_and_distances[1::2]
+        return decompress(data_for_lz77)
+
+    def decode_chunks(self, compressed_data: list) -> np.array:
+        '''
+        Decodes chunks of the older format: (0, values) for stored chunks and
+        (1, lengths_table, lengths_code, literals_table, literals_code) with
+        codes as strings of '0' and '1'
+        '''
         res = []
         for chunk in compressed_data:
             # if the chunk was not compressed
             if chunk[0] == 0:
                 res += list(chunk[1])
                 continue
-            
+
             # decoding huffman trees
             _, distances_table, distances_code, literals_table, literals_code = chunk
             literals = HuffmanCode(literals_code).decode(literals_table)
             literals = list(zip(literals[0::2], literals[1::2]))
             distances = HuffmanCode(distances_code).decode(distances_table)
-            
+
             # preparing struct for lz77 decoding
             data_for_lz77 = []
             for idx, literal in enumerate(literals):
                 elm = list(literal)
                 elm.insert(1, distances[idx])
                 data_for_lz77.append(tuple(elm))
-                
+
 
             decoded_chunk = decompress(np.array(data_for_lz77, dtype=[
             ('offset', 'int64'), ('length', 'int64'),
@@ -110,10 +194,139 @@ class Deflate:
 
             res += list(decoded_chunk)
 
-            
+
         return np.array(res)
 
 
+def encode_packet(data: np.array, level: int=DEFAULT_LEVEL) -> bytes:
+    '''
+    Compresses the array into the payload of a container packet
+    '''
+    return Deflate().encode(data, level).tobytes()
+
+
+def decode_packet(payload) -> np.array:
+    '''
+    Decompresses the payload of a container packet
+    '''
+    return Deflate().decode(np.frombuffer(payload, dtype='uint8'))
+
+
+def decode_legacy_packet(stored) -> np.array:
+    '''
+    Decompresses chunks stored in np.savez_compressed archives of older versions
+    '''
+    return Deflate().decode(stored)
+
+
+class Compressor:
+    '''
+    Incremental Deflate coder: values are buffered and every CHUNK_SIZE of
+    them is coded into a block, so the concatenated output of feed() and
+    flush() is the same stream as Deflate.encode() of all values.
+    '''
+
+    def __init__(self, level: int=DEFAULT_LEVEL, workers: int=1):
+        self.level = level
+        self.deflate = Deflate(workers)
+        self.value_dtype = None
+        self.buffer = []
+        self.buffered = 0
+
+    def encode_blocks(self, data: np.array) -> bytes:
+        '''
+        Encodes whole chunks of data, the first call also writes the stream header
+        '''
+        res = []
+        if self.value_dtype is None:
+            self.value_dtype = data.dtype.newbyteorder('<')
+            res.append(STREAM_HEADER.pack(MAGIC, self.value_dtype.str.encode()))
+        chunks = [data[idx:idx + CHUNK_SIZE] for idx in range(0, len(data), CHUNK_SIZE)]
+        res += self.deflate.map_blocks(
+            self.deflate.encode_block, chunks,
+            [self.value_dtype] * len(chunks), [self.level] * len(chunks)
+        )
+        return b''.join(res)
+
+    def feed(self, chunk: np.array) -> np.array:
+        '''
+        Adds values, returns the blocks of all full chunks
+        '''
+        chunk = np.asarray(chunk).ravel()
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered < CHUNK_SIZE:
+            return np.array([], dtype='uint8')
+
+        data = np.concatenate(self.buffer)
+        whole = len(data) - len(data) % CHUNK_SIZE
+        self.buffer = [data[whole:]]
+        self.buffered = len(data) - whole
+        return np.frombuffer(self.encode_blocks(data[:whole]), dtype='uint8')
+
+    def flush(self) -> np.array:
+        '''
+        Returns the block of the buffered values
+        '''
+        data = np.concatenate(self.buffer) if self.buffer else np.array([], dtype='int64')
+        self.buffer, self.buffered = [], 0
+        return np.frombuffer(self.encode_blocks(data), dtype='uint8')
+
+
+class Decompressor:
+    '''
+    Incremental decoder of the stream written by Compressor or Deflate.encode()
+    '''
+
+    def __init__(self, workers: int=1):
+        self.deflate = Deflate(workers)
+        self.value_dtype = None
+        self.buffer = b''
+
+    def feed(self, chunk) -> np.array:
+        '''
+        Adds bytes of the stream, returns values of all complete blocks
+        '''
+        self.buffer += bytes(np.frombuffer(chunk, dtype='uint8'))
+        if self.value_dtype is None:
+            if len(self.buffer) < STREAM_HEADER.size:
+                return np.array([], dtype='int64')
+            magic, value_dtype = STREAM_HEADER.unpack_from(self.buffer)
+            if magic != MAGIC:
+                raise ValueError('Not a deflate stream')
+            self.value_dtype = np.dtype(value_dtype.rstrip(b'\x00').decode())
+            self.buffer = self.buffer[STREAM_HEADER.size:]
+
+        encoding_types, values_nums, payloads = [], [], []
+        position = 0
+        while len(self.buffer) >= position + BLOCK_HEADER.size:
+            encoding_type, values_num, payload_size = BLOCK_HEADER.unpack_from(self.buffer, position)
+            block_end = position + BLOCK_HEADER.size + payload_size
+            if len(self.buffer) < block_end:
+                break
+            encoding_types.append(encoding_type)
+            values_nums.append(values_num)
+            payloads.append(np.frombuffer(self.buffer[block_end - payload_size:block_end], dtype='uint8'))
+            position = block_end
+        self.buffer = self.buffer[position:]
+
+        res = self.deflate.map_blocks(
+            self.deflate.decode_block, encoding_types, values_nums, payloads,
+            [self.value_dtype] * len(payloads)
+        )
+        if not res:
+            return np.array([], dtype=self.value_dtype.newbyteorder('='))
+        return np.concatenate(res)
+
+    def flush(self) -> np.array:
+        '''
+        Checks that the stream ended with a complete block
+        '''
+        if self.buffer:
+            raise ValueError('Deflate stream ends in the middle of a block')
+        return np.array([], dtype='int64')
+
+
 if __name__ == '__main__':
     d = Deflate()
     # -------- text usage example -----------
@@ -129,15 +342,9 @@ if __name__ == '__main__':
     # -------- image usage example ----------
     print()
     from PIL import Image
-    img = Image.open('examples/test_img.png').convert('RGB')
-    img = np.array(img.getdata())
-    img = np.ravel(img)
+    img = Image.open('examples/image.png').convert('RGB')
+    img = np.ravel(np.array(img, dtype='uint8'))
     print(f'Image size (pixels) before compression: {img.shape[0]}')
-    from time import time
-    start_time = time()
-    res = d.encode(img)
-    print(f'Compression has taken {time() - start_time}')
-    start_time = time()
-    res = d.decode(res)
-    print(f'Decompression has taken {time() - start_time}')
+    res = d.decode(d.encode(img))
     assert np.all(img == res)
+    # speed and ratio of every codec: python3 src/benchmark.py
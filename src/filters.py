@@ -0,0 +1,146 @@
+'''
+PNG-style prediction filters for images.
+
+Every row of the image (or of every channel plane) is replaced by its
+difference from a prediction out of already known neighbours:
+
+    NONE     0
+    SUB      left neighbour
+    UP       neighbour above
+    AVERAGE  mean of left and above
+    PAETH    left, above or upper-left, whichever is closest to left + above - upper-left
+
+Each row takes the filter with the smallest sum of absolute residuals (read
+as signed bytes), as PNG encoders do. Filtered images are mostly small values
+and repeating patterns, which take fewer LZ77 tokens and shorter Huffman codes.
+'''
+
+import numpy as np
+
+NONE = 0
+SUB = 1
+UP = 2
+AVERAGE = 3
+PAETH = 4
+FILTERS = (NONE, SUB, UP, AVERAGE, PAETH)
+
+
+def paeth_predictor(left: np.array, up: np.array, up_left: np.array) -> np.array:
+    '''
+    Returns the neighbour closest to left + up - up_left, for int16 arrays
+    '''
+    estimate = left + up - up_left
+    left_distance = np.abs(estimate - left)
+    up_distance = np.abs(estimate - up)
+    up_left_distance = np.abs(estimate - up_left)
+    return np.where(
+        (left_distance <= up_distance) & (left_distance <= up_left_distance), left,
+        np.where(up_distance <= up_left_distance, up, up_left)
+    )
+
+
+def predictions(left: np.array, up: np.array, up_left: np.array) -> list:
+    '''
+    Returns predictions of every filter in the order of FILTERS
+    '''
+    return [
+        np.zeros_like(left), left, up, (left + up) >> 1, paeth_predictor(left, up, up_left)
+    ]
+
+
+def to_planes(image: np.array, planar: bool) -> np.array:
+    '''
+    Returns (planes, height, width, samples) view of an image: one plane per
+    channel when planar, otherwise one plane of interleaved pixels
+    '''
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    if planar:
+        return image.transpose(2, 0, 1)[:, :, :, np.newaxis]
+    return image[np.newaxis]
+
+
+def filter_image(image: np.array, planar: bool=False) -> np.array:
+    '''
+    Filters a (height, width[, channels]) uint8 image.
+
+    Interleaved images are filtered as in PNG: one filter per row, a pixel is
+    predicted from the same channel of its neighbours. Planar images have the
+    channels one after another, each with its own row filters, which suits
+    photos better than images with large flat areas.
+
+    Returns flat uint8 array: filter of every row of every plane followed by
+    the filtered planes.
+    '''
+    planes = to_planes(np.asarray(image, dtype='uint8'), planar).astype('int16')
+    planes_num, height, width, samples = planes.shape
+
+    padded = np.zeros((planes_num, height + 1, width + 1, samples), dtype='int16')
+    padded[:, 1:, 1:] = planes
+    residuals = (planes - np.stack(predictions(
+        padded[:, 1:, :-1], padded[:, :-1, 1:], padded[:, :-1, :-1]
+    ))).astype('uint8')
+
+    # the row filter with the smallest residuals, read as signed bytes
+    costs = np.abs(residuals.view('int8').astype('int32')).sum(axis=(3, 4))
+    row_filters = costs.argmin(axis=0).astype('uint8')
+    filtered = np.take_along_axis(
+        residuals, row_filters[np.newaxis, :, :, np.newaxis, np.newaxis], axis=0
+    )[0]
+    return np.concatenate([row_filters.ravel(), filtered.ravel()])
+
+
+def unfilter_image(filtered: np.array, shape, planar: bool=False) -> np.array:
+    '''
+    Restores the image of the given (height, width[, channels]) shape from
+    output of filter_image.
+
+    A pixel depends on its left, upper and upper-left neighbours, so all
+    pixels of one anti-diagonal (row + column = const) of all planes are
+    restored at once from the two anti-diagonals before it.
+    '''
+    height, width, channels = (list(shape) + [1])[:3]
+    planes_num, samples = (channels, 1) if planar else (1, channels)
+    filtered = np.asarray(filtered).astype('uint8')
+    row_filters = filtered[:planes_num * height].reshape(planes_num, height)
+    residuals = filtered[planes_num * height:].reshape(planes_num, height, width, samples)
+
+    # pixels ordered by anti-diagonal, all planes and samples of a pixel together
+    diagonals = np.arange(height + width - 1)
+    first_rows = np.maximum(0, diagonals - width + 1)
+    diagonal_lengths = np.minimum(diagonals, height - 1) - first_rows + 1
+    pixel_diagonals = np.repeat(diagonals, diagonal_lengths)
+    diagonal_ends = np.cumsum(diagonal_lengths)
+    rows = np.arange(height * width) - np.repeat(diagonal_ends - diagonal_lengths, diagonal_lengths)
+    rows += first_rows[pixel_diagonals]
+    columns = pixel_diagonals - rows
+    del pixel_diagonals
+
+    padded = np.zeros((planes_num, height + 1, width + 1, samples), dtype='int16')
+    positions = (
+        (((rows + 1) * (width + 1) + columns + 1) * samples)[:, np.newaxis, np.newaxis] +
+        (np.arange(planes_num) * (height + 1) * (width + 1) * samples)[:, np.newaxis] +
+        np.arange(samples)
+    ).ravel()
+    sample_filters = np.repeat(row_filters.T[rows], samples, axis=1).ravel().astype(np.intp)
+    sample_residuals = residuals.transpose(1, 2, 0, 3)[rows, columns].ravel().astype('int16')
+    diagonal_ends *= planes_num * samples
+    del rows, columns
+
+    flat = padded.ravel()
+    left_shift = samples
+    up_shift = (width + 1) * samples
+    start = 0
+    for end in diagonal_ends.tolist():
+        current = positions[start:end]
+        predicted = np.choose(sample_filters[start:end], predictions(
+            flat[current - left_shift], flat[current - up_shift],
+            flat[current - up_shift - left_shift]
+        ))
+        flat[current] = (sample_residuals[start:end] + predicted) & 255
+        start = end
+
+    image = padded[:, 1:, 1:]
+    if planar:
+        image = image[:, :, :, 0].transpose(1, 2, 0)
+    return image.astype('uint8').reshape(shape)
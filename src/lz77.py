@@ -2,159 +2,545 @@
 LZ77 Compression alghorithm.
 '''
 
+import struct
 import numpy as np
-from time import time
-from typing import Tuple, List
+from array import array
+from typing import Tuple, List, Optional
+from registry import DEFAULT_LEVEL
+import metrics
+
+MIN_MATCH = 3
+# every token has the same size, so a match of two symbols still saves one
+SHORT_MATCH = 2
+# level: (parsing strategy, max hash chain candidates walked per position)
+LEVELS = {
+    1: ('first', 8),
+    2: ('greedy', 4),
+    3: ('greedy', 8),
+    4: ('greedy', 16),
+    5: ('greedy', 32),
+    6: ('lazy', 32),
+    7: ('lazy', 64),
+    8: ('lazy', 128),
+    9: ('optimal', 256),
+}
+# optimal parsing does not search again inside matches at least this long
+OPTIMAL_LONG_MATCH = 256
+TOKEN_FIELDS = ('offset', 'length', 'value')
+# number of tokens and dtypes of their fields
+TOKENS_HEADER = struct.Struct('<I4s4s4s')
+
 
 def compress(
-        initial_input_array: np.array, max_offset: int=255, max_length: int=65535
+        initial_input_array: np.array, max_offset: int=255, max_length: int=65535,
+        level: int=DEFAULT_LEVEL, max_chain: Optional[int]=None
     ) -> List[Tuple[int, int, str]]:
+    '''
+    Compress array into (offset, length, value) tokens.
+
+    Matches are looked up through hash chains over the next MIN_MATCH symbols,
+    walking at most max_chain candidates per position (set by level if not
+    given). Where the chain has no match, the closest earlier occurrence of
+    the next SHORT_MATCH symbols is used. Tokens with offset 0 are runs of
+    `length` copies of `value`.
+
+    Level (1-9) chooses the parsing strategy:
+        - first: take the first match found on the chain (fastest)
+        - greedy: take the longest match at every position
+        - lazy: skip a match if the next position has a longer one
+        - optimal: search every position and choose the fewest tokens
+          that the matches found (longest one per position) allow
+    '''
+    data = np.asarray(initial_input_array)
+    output, _ = compress_range(data, 0, len(data), max_offset, max_length, level, max_chain)
+    return output
+
+
+def compress_range(
+        data: np.array, start: int, stop: int, max_offset: int=255, max_length: int=65535,
+        level: int=DEFAULT_LEVEL, max_chain: Optional[int]=None
+    ) -> Tuple[np.array, int]:
+    '''
+    Compress data into tokens starting in [start, stop), symbols before
+    start are only used as the window. The last token may end after stop.
+    Returns the tokens and the position after the last one.
+    '''
+    if level not in LEVELS:
+        raise ValueError(f'Compression level must be one of {sorted(LEVELS)}')
+    strategy, level_chain = LEVELS[level]
+    if max_chain is None:
+        max_chain = level_chain
+
+    with metrics.timer('lz77.match_search'):
+        values = data.tolist()
+        prev = array('q')
+        prev.frombytes(hash_chains(data).tobytes())
+        short_prev = array('q')
+        short_prev.frombytes(hash_chains(data, SHORT_MATCH).tobytes())
+
+        if strategy == 'optimal':
+            positions, lengths, offsets = optimal_parse(
+                values, data, prev, short_prev, max_offset, max_length, max_chain, start, stop
+            )
+        else:
+            positions, lengths, offsets = greedy_parse(
+                values, data, prev, short_prev, max_offset, max_length, max_chain,
+                first_match=strategy == 'first', lazy=strategy == 'lazy', start=start, stop=stop
+            )
 
-    output = []
+    with metrics.timer('lz77.tokens'):
+        output = np.zeros(len(positions), dtype=token_dtype(data.dtype))
+        output['offset'] = offsets
+        output['length'] = lengths
+        output['value'] = data[positions]
+    end = positions[-1] + lengths[-1] if positions else max(start, 0)
+    if metrics.enabled:
+        count_tokens(output)
+    return output, end
 
-    buffer = np.array([])
-    input_array = initial_input_array
 
-    current_cut_position = 0
+def token_dtype(value_dtype: np.dtype) -> np.dtype:
+    return np.dtype([('offset', 'uint8'), ('length', 'uint16'), ('value', value_dtype)])
 
-    # print_i = 0
-    while len(input_array) != 0:
-        # print_i += 1
-        # if print_i % 1000 == 0:
-        #     print(current_cut_position, end='    \r')
-        length, offset = best_length_offset(buffer, input_array, max_length, max_offset)
-        output.append((offset, length, input_array[0]))
+
+def count_tokens(tokens: np.array) -> None:
+    '''
+    Adds numbers of tokens, matches and literals (runs) to the metrics
+    '''
+    is_match = tokens['offset'] != 0
+    lengths = tokens['length'].astype('int64')
+    metrics.count('lz77.tokens', len(tokens))
+    metrics.count('lz77.symbols', int(lengths.sum()))
+    metrics.count('lz77.matches', int(np.count_nonzero(is_match)))
+    metrics.count('lz77.match_symbols', int(lengths[is_match].sum()))
+    metrics.count('lz77.literals', int(np.count_nonzero(~is_match)))
+
+
+def greedy_parse(
+        values: list, data: np.array, prev: array, short_prev: array,
+        max_offset: int, max_length: int,
+        max_chain: int, first_match: bool=False, lazy: bool=False,
+        start: int=0, stop: Optional[int]=None
+    ) -> Tuple[List[int], List[int], List[int]]:
+    '''
+    Splits the array from start into tokens starting before stop (by default
+    up to the end), taking the match found at every position.
+    With lazy parsing a match is replaced by a single symbol run when the
+    run and the match after it reach further than the match and the token
+    after it, both ways take two tokens.
+    Returns token positions, lengths and offsets.
+    '''
+    offsets: List[int] = []
+    lengths: List[int] = []
+    positions: List[int] = []
+
+    if stop is None:
+        stop = len(values)
+    # matches already searched at positions not passed yet
+    found = {}
+
+    def match_at(position: int) -> Tuple[int, int]:
+        if position not in found:
+            found[position] = longest_match(
+                values, data, prev, short_prev, position,
+                max_offset, max_length, max_chain, first_match
+            )
+        return found[position]
+
+    current_cut_position = start
+    while current_cut_position < stop:
+        length, offset = match_at(current_cut_position)
+        if lazy and offset != 0 and current_cut_position + length < len(values):
+            skipped_length = match_at(current_cut_position + 1)[0]
+            if (
+                skipped_length > length and
+                1 + skipped_length > length + match_at(current_cut_position + length)[0]
+            ):
+                length, offset = 1, 0
+
+        offsets.append(offset)
+        lengths.append(length)
+        positions.append(current_cut_position)
         current_cut_position += length
-        buffer = initial_input_array[:current_cut_position]
-        input_array = initial_input_array[current_cut_position:]
+        for position in [position for position in found if position < current_cut_position]:
+            del found[position]
 
-    return np.array(output, dtype=[
-        ('offset', 'uint8'), ('length', 'uint16'),
-        ('value', initial_input_array.dtype)
-    ])
+    return positions, lengths, offsets
 
 
-def merge_parts(compressed):
-    """
-    will reduce element num if repetitions exceed max length
-    remember to set length type 'uint16' -> 'uint32'
-    """
-    compressed_new = [list(compressed[0])]
-    for compressed_i, (offset, length, data) in enumerate(compressed[1:]):
-        if (
-            data == compressed_new[-1][2] and
-            offset != 0 and (
-                (compressed_i + 1) < len(compressed) and
-                length > compressed[compressed_i + 1][0]
-            ) and (
-                compressed_new[-1][0] <= compressed_new[-1][1]
-            ) and offset <= compressed_new[-1][1]
-        ):
-            compressed_new[-1][1] += length
-        else:
-            compressed_new.append([offset, length, data])
-    return [tuple(element) for element in compressed_new]
-
-
-def repeating_length_from_start(buffer: np.array, input_array: np.array):
-    '''
-    Return the repeating length of the input array from the start of buffer.
-    '''
-    min_len = min(len(buffer), len(input_array))
-    not_equal_indexes = np.flatnonzero(buffer[:min_len] != input_array[:min_len])
-    if len(not_equal_indexes) == 0:
-        length_delta = 0
-        while len(not_equal_indexes) == 0:
-            if len(buffer) < len(input_array):
-                length_delta += min_len
-                input_array = input_array[min_len:]
-                min_len = min(len(buffer), len(input_array))
-                not_equal_indexes = np.flatnonzero(buffer[:min_len] != input_array[:min_len])
-            else:
-                return min_len + length_delta
-        return not_equal_indexes[0] + length_delta
-    else:
-        return not_equal_indexes[0]
-
-
-def best_length_offset(
-        buffer: np.array, input_array: np.array,
-        max_length: int=15, max_offset: int=4095
-    ) -> Tuple[int, int]:
+def optimal_parse(
+        values: list, data: np.array, prev: array, short_prev: array,
+        max_offset: int, max_length: int, max_chain: int,
+        start: int=0, stop: Optional[int]=None
+    ) -> Tuple[List[int], List[int], List[int]]:
+    '''
+    Splits the array from start into the fewest tokens starting before stop
+    (by default up to the end). Any prefix of a match or run is
+    a valid token, so from every position the parse may jump up to the
+    length of its token; jumping to the position that reaches furthest
+    gives the minimal number of tokens for the matches found. The parse is
+    only as good as the match search: a match missed by the hash chains
+    (longer than max_chain candidates) is not used, and positions inside
+    matches of at least OPTIMAL_LONG_MATCH symbols are not searched, they
+    reach the match end.
+    Returns token positions, lengths and offsets.
+    '''
+    if stop is None:
+        stop = len(values)
+    reach_lengths = np.zeros(len(values), dtype='int64')
+    reach_offsets = np.zeros(len(values), dtype='int64')
+    position = start
+    while position < len(values):
+        length, offset = longest_match(
+            values, data, prev, short_prev, position, max_offset, max_length, max_chain
+        )
+        reach_lengths[position] = length
+        reach_offsets[position] = offset
+        if length < OPTIMAL_LONG_MATCH:
+            position += 1
+            continue
+        # the rest of a long match is trusted to reach its end
+        reach_lengths[position + 1:position + length] = np.arange(length - 1, 0, -1)
+        reach_offsets[position + 1:position + length] = offset
+        position += length
 
-    cut_buffer = buffer[-max_offset:]
+    reach_ends = np.arange(len(values)) + reach_lengths
+    offsets: List[int] = []
+    lengths: List[int] = []
+    positions: List[int] = []
 
-    if input_array[0] not in cut_buffer:
-        for i in range(10):
-            if not (len(input_array) > (i + 1) and input_array[i + 1] == input_array[i]):
-                best_length = i
-                break
-        else:
-            input_array = input_array[:max_length]
-            not_equal_indexes = np.flatnonzero(input_array[1:] != input_array[0])
-            best_length = max(len(input_array) - 1, 0) if len(not_equal_indexes) == 0 else not_equal_indexes[0]
-        return min(
-            best_length + 1, max_length
-        ), 0
+    current_cut_position = start
+    while current_cut_position < stop:
+        length = int(reach_lengths[current_cut_position])
+        if current_cut_position + length < len(values):
+            # the next token starts where the parse reaches furthest
+            window = reach_ends[current_cut_position + 1:current_cut_position + length + 1]
+            length = 1 + int(np.argmax(window))
+        offsets.append(int(reach_offsets[current_cut_position]))
+        lengths.append(length)
+        positions.append(current_cut_position)
+        current_cut_position += length
 
-    input_array = input_array[:max_length]
+    return positions, lengths, offsets
 
-    length, offset = 0, 0
 
-    for index in range(len(cut_buffer), 0, -1):
+def hash_chains(data: np.array, key_length: int=MIN_MATCH) -> np.array:
+    '''
+    Return the prev chain table of the array: prev[i] is the closest position
+    before i starting with the same key_length symbols, or -1 if there is none.
+
+    The next key_length symbols are used as the hash key itself, so chains
+    never contain false candidates.
+    '''
+    prev = np.full(len(data), -1, dtype='int64')
+    heads = len(data) - key_length + 1
+    if heads <= 1:
+        return prev
 
-        char = cut_buffer[-index]
-        if char == input_array[0]:
+    keys = [data[shift:shift + heads] for shift in range(key_length)]
+    # sort positions by key, equal keys stay in increasing position order
+    order = np.lexsort([np.arange(heads)] + keys[::-1])
+    same_key = np.ones(heads - 1, dtype=bool)
+    for key in keys:
+        sorted_key = key[order]
+        same_key &= sorted_key[1:] == sorted_key[:-1]
+    prev[order[1:][same_key]] = order[:-1][same_key]
+    return prev
 
-            found_length = repeating_length_from_start(cut_buffer[-index:], input_array)
 
+def match_length(
+        values: list, data: np.array, candidate: int, position: int, limit: int
+    ) -> int:
+    '''
+    Return how many symbols starting at position repeat the ones starting
+    at candidate (at most limit). Short matches are compared symbol by
+    symbol, long ones in growing numpy blocks.
+    '''
+    length = 0
+    short_limit = min(limit, 32)
+    while length < short_limit and values[candidate + length] == values[position + length]:
+        length += 1
+    if length < short_limit:
+        return length
+
+    block = 64
+    while length < limit:
+        end = min(length + block, limit)
+        not_equal_indexes = np.flatnonzero(
+            data[candidate + length:candidate + end] != data[position + length:position + end]
+        )
+        if len(not_equal_indexes) != 0:
+            return length + int(not_equal_indexes[0])
+        length = end
+        block *= 2
+    return length
+
+
+def longest_match(
+        values: list, data: np.array, prev: array, short_prev: array, position: int,
+        max_offset: int, max_length: int, max_chain: int, first_match: bool=False
+    ) -> Tuple[int, int]:
+    '''
+    Find the token for the given position by walking its hash chain,
+    stopping at the first usable match if first_match is set. Without a
+    match of MIN_MATCH symbols the closest candidate of the SHORT_MATCH
+    chain is taken.
+    Returns (length, offset), offset is 0 for a run of the current symbol.
+    '''
+    limit = min(max_length, len(values) - position)
+    run_length = 1 + match_length(values, data, position, position + 1, limit - 1)
+
+    length, offset = 0, 0
+    candidate = prev[position]
+    depth = 0
+    while (
+        candidate >= 0 and position - candidate <= max_offset and
+        depth < max_chain and length < limit
+    ):
+        # a longer match must also differ from the current best at its end
+        if values[candidate + length] == values[position + length]:
+            found_length = match_length(values, data, candidate, position, limit)
             if found_length > length:
                 length = found_length
-                offset = index
+                offset = position - candidate
+                if first_match and length >= MIN_MATCH:
+                    break
+        candidate = prev[candidate]
+        depth += 1
 
-                # break  # uncomment for fast (but uneffective) convertion (suitable for video)
+    if length < MIN_MATCH:
+        candidate = short_prev[position]
+        if candidate >= 0 and position - candidate <= max_offset and limit >= SHORT_MATCH:
+            length = match_length(values, data, candidate, position, limit)
+            offset = position - candidate
 
-                if length >= len(input_array):
-                    # we won't find anything better
-                    break
+    if length < SHORT_MATCH or length <= run_length:
+        return run_length, 0
+    return length, offset
 
-    return min(length, max_length), offset
 
+VECTORIZED_MIN_TOKENS = 64
+# streams of long tokens are copied faster slice by slice: on 400 KB of
+# runs the loop wins from about 70 symbols per token (images average ~250),
+# at 20-40 symbols per token the vectorized path is twice as fast
+LOOP_MIN_AVERAGE_LENGTH = 64
 
-def decompress(compressed: List[Tuple[int, int, int]]) -> np.array:
+
+def decompress(compressed: List[Tuple[int, int, int]], vectorized: bool=True) -> np.array:
     '''
     Decompress array.
+
+    Every output element is first pointed at the element it copies from
+    (itself for runs), then the pointers are resolved in waves of pointer
+    jumping until all of them land on run elements, so a chain of k
+    overlapping back-references takes log2(k) numpy passes. Short token
+    streams and streams of long tokens go through the per-token loop.
+    '''
+    with metrics.timer('lz77.decode'):
+        return decompress_pointers(compressed, vectorized)
+
+
+def decompress_pointers(compressed: np.array, vectorized: bool=True) -> np.array:
     '''
-    arr_size = np.sum(compressed['length'])
+    Decompress array by pointer jumping, see decompress
+    '''
+    lengths = compressed['length'].astype('int64')
+    arr_size = int(np.sum(lengths))
+    if (
+        not vectorized or len(compressed) < VECTORIZED_MIN_TOKENS or
+        arr_size >= LOOP_MIN_AVERAGE_LENGTH * len(compressed)
+    ):
+        return decompress_tokens(compressed)
+
+    index_type = 'int32' if arr_size < 2 ** 31 else 'int64'
+
+    # token of every output element, runs are expanded here as well
+    token_indexes = np.repeat(np.arange(len(compressed), dtype=index_type), lengths)
+    starts = np.zeros(len(compressed), dtype=index_type)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    sources = np.arange(arr_size, dtype=index_type)
+
+    # overlapping copies repeat the last `offset` elements before the token,
+    # so every copied element is pointed straight in front of its token
+    is_run = compressed['offset'] == 0
+    copied = np.flatnonzero(~is_run[token_indexes])
+    copied_tokens = token_indexes[copied]
+    copied_offsets = compressed['offset'][copied_tokens].astype(index_type)
+    copied_starts = starts[copied_tokens]
+    sources[copied] = copied_starts - copied_offsets + (copied - copied_starts) % copied_offsets
+    if len(copied) and sources[copied].min() < 0:
+        raise ValueError('Back-reference points before the start of the data')
+    del copied_tokens, copied_offsets, copied_starts
+
+    pending = copied[~is_run[token_indexes[sources[copied]]]]
+    while len(pending) != 0:
+        sources[pending] = sources[sources[pending]]
+        pending = pending[~is_run[token_indexes[sources[pending]]]]
+
+    return compressed['value'][token_indexes[sources]]
+
+
+def decompress_tokens(compressed: List[Tuple[int, int, int]]) -> np.array:
+    '''
+    Decompress array token by token.
+    '''
+    arr_size = int(np.sum(compressed['length']))
     decompressed_array = np.zeros(arr_size, dtype=compressed.dtype[2])
     current_index = 0
-    for value in compressed:
-        offset, length, char = value
+    for offset, length, char in compressed.tolist():
         if offset == 0:
             decompressed_array[current_index:current_index+length] = char
             current_index += length
-        else:
-            while length >= offset:
-                decompressed_array[
-                    current_index:current_index + offset
-                ] = decompressed_array[current_index-offset:current_index]
-                current_index += offset
-                length -= offset
+        elif length <= offset:
             decompressed_array[
                 current_index:current_index + length
             ] = decompressed_array[current_index-offset:current_index-offset+length]
             current_index += length
+        else:
+            # overlapping copy repeats the last `offset` elements
+            decompressed_array[current_index:current_index + length] = np.resize(
+                decompressed_array[current_index-offset:current_index], length
+            )
+            current_index += length
 
     return decompressed_array
 
+def tokens_to_bytes(tokens: np.array) -> bytes:
+    '''
+    Serializes tokens: their number and field dtypes, then offsets,
+    lengths and values each as a separate little-endian array.
+    '''
+    fields = [tokens[name] for name in TOKEN_FIELDS]
+    dtypes = [field.dtype.newbyteorder('<') for field in fields]
+    return b''.join([
+        TOKENS_HEADER.pack(len(tokens), *(dtype.str.encode() for dtype in dtypes))
+    ] + [field.astype(dtype).tobytes() for field, dtype in zip(fields, dtypes)])
+
+
+def tokens_from_bytes(buffer, position: int=0) -> np.array:
+    '''
+    Reads tokens written by tokens_to_bytes.
+    '''
+    tokens_num, *dtypes = TOKENS_HEADER.unpack_from(buffer, position)
+    dtypes = [np.dtype(dtype.rstrip(b'\x00').decode()) for dtype in dtypes]
+    tokens = np.zeros(tokens_num, dtype=[
+        (name, dtype.newbyteorder('=')) for name, dtype in zip(TOKEN_FIELDS, dtypes)
+    ])
+    position += TOKENS_HEADER.size
+    for name, dtype in zip(TOKEN_FIELDS, dtypes):
+        tokens[name] = np.frombuffer(buffer, dtype=dtype, count=tokens_num, offset=position)
+        position += tokens_num * dtype.itemsize
+    return tokens
+
+
+def encode_packet(data: np.array, level: int=DEFAULT_LEVEL) -> bytes:
+    '''
+    Compresses the array into the payload of a container packet
+    '''
+    return tokens_to_bytes(compress(np.asarray(data).ravel(), level=level))
+
+
+def decode_packet(payload) -> np.array:
+    '''
+    Decompresses the payload of a container packet
+    '''
+    return decompress(tokens_from_bytes(payload))
+
+
+def decode_legacy_packet(stored) -> np.array:
+    '''
+    Decompresses tokens stored in np.savez_compressed archives of older versions
+    '''
+    return decompress(stored)
+
+
+class Compressor:
+    '''
+    Incremental lz77 compressor keeping the last max_offset symbols as the
+    window. feed() returns tokens of the input that has max_length symbols
+    of lookahead behind it, flush() returns tokens of the rest. Every
+    compression searches the window and the lookahead again, so input is
+    compressed only once max_length symbols beyond the lookahead are buffered.
+    '''
+    def __init__(
+            self, max_offset: int=255, max_length: int=65535,
+            level: int=DEFAULT_LEVEL, max_chain: Optional[int]=None
+        ) -> None:
+        self.max_offset = max_offset
+        self.max_length = max_length
+        self.level = level
+        self.max_chain = max_chain
+        # the window followed by the chunks not coded yet
+        self.buffer = []
+        self.buffered = 0
+        # number of symbols at the start of the buffer that are already coded
+        self.history = 0
+
+    def feed(self, chunk: np.array) -> np.array:
+        '''
+        Adds chunk to the input and returns tokens that are ready
+        '''
+        chunk = np.asarray(chunk).ravel()
+        self.buffer.append(chunk)
+        self.buffered += len(chunk)
+        if self.buffered < 2 * self.max_length:
+            return np.zeros(0, dtype=token_dtype(chunk.dtype))
+        data = np.concatenate(self.buffer)
+        return self.compress_buffer(data, len(data) - self.max_length)
+
+    def flush(self) -> np.array:
+        '''
+        Returns tokens of all remaining input
+        '''
+        data = np.concatenate(self.buffer) if self.buffer else np.array([], dtype='uint8')
+        return self.compress_buffer(data, len(data))
+
+    def compress_buffer(self, data: np.array, stop: int) -> np.array:
+        tokens, end = compress_range(
+            data, self.history, stop, self.max_offset, self.max_length,
+            self.level, self.max_chain
+        )
+        self.history = min(end, self.max_offset)
+        self.buffer = [data[end - self.history:]]
+        self.buffered = len(data) - end
+        return tokens
+
+
+class Decompressor:
+    '''
+    Incremental lz77 decompressor keeping the last max_offset decoded
+    symbols, so tokens may refer to output of previous feeds.
+    '''
+    def __init__(self, max_offset: int=255) -> None:
+        self.max_offset = max_offset
+        self.history = None
+
+    def feed(self, tokens: np.array) -> np.array:
+        '''
+        Decodes tokens, returns the symbols they produce
+        '''
+        if self.history is None:
+            self.history = np.array([], dtype=tokens.dtype[2])
+        # the window goes in front as single symbol runs
+        window = np.zeros(len(self.history), dtype=tokens.dtype)
+        window['length'] = 1
+        window['value'] = self.history
+        decompressed = decompress(np.concatenate([window, tokens]))[len(self.history):]
+
+        self.history = np.concatenate([self.history, decompressed])[-self.max_offset:]
+        return decompressed
+
+    def flush(self) -> np.array:
+        '''
+        Returns the rest of output, tokens are decoded completely in feed
+        '''
+        return np.array([], dtype='uint8' if self.history is None else self.history.dtype)
+
+
 if __name__ == "__main__":
-    for name in ['examples/test_img.bzbi']:
-        print(name, end=':\n')
-        img = np.load(name, allow_pickle=True)[0]
-        print(len(img))
-        t = time()
-        img_comp = compress(img)
-        print(img_comp)
-        print(len(img_comp), end='        \n')
-        print(time() - t)
-        print(np.all(decompress(img_comp) == img))
+    from PIL import Image
+    img = np.ravel(np.array(Image.open('examples/image.png').convert('RGB'), dtype='uint8'))
+    img_comp = compress(img)
+    print(f'Image of {len(img)} bytes compressed into {len(img_comp)} tokens')
+    assert np.all(decompress(img_comp) == img)
+    # speed and ratio of every codec: python3 src/benchmark.py
@@ -1,61 +1,386 @@
+import struct
 import numpy as np
-from typing import List, Tuple, Dict
+from array import array
+from typing import List, Dict, Optional
+from bitstream import pack_codes, unpack_codes, bit_lengths
+import metrics
 
-def lzw_compress(data: np.array) -> np.array:
+# magic, alphabet size, max dictionary size, full dictionary policy, number of codes
+HEADER = struct.Struct('<4sIIBQ')
+MAGIC = b'LZWV'
+# streams start with the same header without the number of codes,
+# followed by segments: number of codes and the packed codes
+STREAM_HEADER = struct.Struct('<4sIIB')
+STREAM_MAGIC = b'LZWS'
+SEGMENT_HEADER = struct.Struct('<I')
+DEFAULT_MAX_DICT_SIZE = 1 << 16
+# what happens to a full dictionary: start over from single symbols or keep it as is
+RESET = 'reset'
+FREEZE = 'freeze'
+POLICIES = (RESET, FREEZE)
+
+
+def dict_size_limit(alphabet_size: int, max_dict_size: Optional[int]) -> int:
+    '''
+    Returns the max dictionary size, by default the larger of
+    DEFAULT_MAX_DICT_SIZE and twice the alphabet size
+    '''
+    if max_dict_size is None:
+        return max(DEFAULT_MAX_DICT_SIZE, 2 * alphabet_size)
+    if max_dict_size < alphabet_size:
+        raise ValueError('LZW dictionary must fit at least the whole alphabet')
+    return max_dict_size
+
+
+def code_widths(
+        codes_num: int, alphabet_size: int, max_dict_size: int, policy: str, first_index: int=0
+    ) -> np.array:
+    '''
+    Returns the bit width of every code starting from the first_index-th one:
+    the width of the largest code the dictionary can hold when it is written
     '''
-    Compresses an array of bits into smaller one
+    code_indexes = np.arange(first_index, first_index + codes_num, dtype='int64')
+    if policy == RESET:
+        dict_sizes = alphabet_size + code_indexes % (max_dict_size - alphabet_size + 1)
+    else:
+        dict_sizes = alphabet_size + np.minimum(code_indexes, max_dict_size - alphabet_size)
+    return np.maximum(bit_lengths(dict_sizes - 1), 1)
+
+
+class Compressor:
+    '''
+    Incremental LZW compressor of symbols from [0, alphabet_size)
+
+    The dictionary maps (prefix code, symbol) pairs, packed into one integer
+    key, to the code of the extended phrase. Once it holds max_dict_size
+    codes it is either reset to single symbols or frozen, depending on policy.
+    feed() returns a stream segment with the codes finished so far,
+    flush() the segment with the last code.
     '''
+    def __init__(
+            self, alphabet_size: int=256, max_dict_size: Optional[int]=None, policy: str=RESET
+        ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f'Unsupported LZW dictionary policy: {policy}')
+        self.alphabet_size = alphabet_size
+        self.max_dict_size = dict_size_limit(alphabet_size, max_dict_size)
+        self.policy = policy
+
+        self.mapping_dict: Dict[int, int] = {}
+        self.dict_size: int = alphabet_size
+        self.current_code: Optional[int] = None
+        self.codes_num: int = 0
+        self.header_written = False
+
+    def encode(self, data: np.array) -> List[int]:
+        '''
+        Adds symbols to the input, returns codes of the finished phrases
+        '''
+        with metrics.timer('lzw.encode'):
+            res = self.encode_phrases(data)
+        metrics.count('lzw.symbols', np.size(data))
+        metrics.count('lzw.codes', len(res))
+        metrics.maximum('lzw.dictionary_size', self.dict_size)
+        return res
+
+    def encode_phrases(self, data: np.array) -> List[int]:
+        symbols = np.asarray(data).ravel()
+        if len(symbols) == 0:
+            return []
+        if symbols.min() < 0 or symbols.max() >= self.alphabet_size:
+            raise ValueError(f'LZW symbols must be in range [0, {self.alphabet_size})')
 
-    dict_size: int = 256
-    mapping_dict: Dict[str, int] = {str(i): i for i in range(dict_size)}
+        alphabet_size = self.alphabet_size
+        mapping_dict = self.mapping_dict
+        symbols = symbols.tolist()
+        if self.current_code is None:
+            self.current_code = symbols.pop(0)
+        current_code: int = self.current_code
+        res: List[int] = []
+        for symbol in symbols:
+            next_code = mapping_dict.get(current_code * alphabet_size + symbol)
+            if next_code is not None:
+                current_code = next_code
+                continue
 
-    current_word: str = ''
-    res: List[int] = []
-    for num in data:
-        next_word: Tuple[int] = f'{current_word}{num}'
-        if next_word in mapping_dict:
-            current_word = next_word
-        else:
-            res.append(mapping_dict[current_word])
-            mapping_dict[next_word] = dict_size
-            dict_size += 1
-            current_word = str(num)
+            res.append(current_code)
+            if self.dict_size < self.max_dict_size:
+                mapping_dict[current_code * alphabet_size + symbol] = self.dict_size
+                self.dict_size += 1
+            elif self.policy == RESET:
+                metrics.maximum('lzw.dictionary_size', self.dict_size)
+                metrics.count('lzw.resets')
+                mapping_dict.clear()
+                self.dict_size = alphabet_size
+            current_code = symbol
 
-    if current_word:
-        res.append(mapping_dict[current_word])
+        self.current_code = current_code
+        return res
 
-    return np.array(res)
+    def finish(self) -> List[int]:
+        '''
+        Returns the code of the last phrase
+        '''
+        if self.current_code is None:
+            return []
+        res, self.current_code = [self.current_code], None
+        metrics.count('lzw.codes')
+        return res
 
+    def pack(self, codes: List[int]) -> np.array:
+        '''
+        Packs codes at their widths, in a segment after the stream header
+        '''
+        with metrics.timer('lzw.pack'):
+            packed, _ = pack_codes(codes, code_widths(
+                len(codes), self.alphabet_size, self.max_dict_size, self.policy, self.codes_num
+            ))
+        self.codes_num += len(codes)
+        res = [SEGMENT_HEADER.pack(len(codes)), packed.tobytes()]
+        if not self.header_written:
+            res.insert(0, STREAM_HEADER.pack(
+                STREAM_MAGIC, self.alphabet_size, self.max_dict_size, POLICIES.index(self.policy)
+            ))
+            self.header_written = True
+        return np.frombuffer(b''.join(res), dtype='uint8')
 
-def lzw_decompress(compressed: np.array) -> np.array:
+    def feed(self, chunk: np.array) -> np.array:
+        return self.pack(self.encode(chunk))
+
+    def flush(self) -> np.array:
+        return self.pack(self.finish())
+
+
+class Decompressor:
     '''
-    Decompresses an array of bits into smaller one
+    Incremental LZW decompressor
+
+    Every code is stored as its prefix code and last symbol, phrases are
+    written out from their last symbol backwards for all codes at once.
+    The dictionary mirrors the encoder: once it holds max_dict_size codes
+    it is reset or frozen, so it never grows beyond max_dict_size.
+    Dictionary parameters are read from the stream header when fed with
+    the output of Compressor, or given for decode_codes.
     '''
+    def __init__(
+            self, alphabet_size: int=256, max_dict_size: Optional[int]=None, policy: str=RESET
+        ) -> None:
+        self.set_dictionary(alphabet_size, max_dict_size, policy)
+        self.buffer = b''
+        self.header_read = False
+        self.codes_num = 0
+
+    def set_dictionary(self, alphabet_size: int, max_dict_size: Optional[int], policy: str) -> None:
+        self.alphabet_size = alphabet_size
+        self.max_dict_size = np.inf if max_dict_size is None else max_dict_size
+        self.policy = policy
+
+        self.prefixes = array('q', [-1] * alphabet_size)
+        self.last_symbols = array('q', range(alphabet_size))
+        self.first_symbols = array('q', range(alphabet_size))
+        self.lengths = array('q', [1] * alphabet_size)
+        self.dict_size: int = alphabet_size
+        self.previous_code: Optional[int] = None
+
+    def decode_codes(self, codes: np.array) -> np.array:
+        '''
+        Decodes codes into an array of symbols
+        '''
+        with metrics.timer('lzw.decode'):
+            return self.decode_phrases(codes)
+
+    def decode_phrases(self, codes: np.array) -> np.array:
+        prefixes, last_symbols = self.prefixes, self.last_symbols
+        first_symbols, lengths = self.first_symbols, self.lengths
+        alphabet_size = self.alphabet_size
+
+        res = []
+        phrases: List[int] = []
+        for code in np.asarray(codes, dtype='int64').tolist():
+            previous_code = self.previous_code
+            if previous_code is None:
+                if not 0 <= code < alphabet_size:
+                    raise ValueError(f'Invalid LZW code {code}')
+            elif self.dict_size < self.max_dict_size:
+                if code < self.dict_size:
+                    first_symbol = first_symbols[code]
+                elif code == self.dict_size:
+                    # the code is being defined right now: previous phrase + its first symbol
+                    first_symbol = first_symbols[previous_code]
+                else:
+                    raise ValueError(f'Invalid LZW code {code}')
+                prefixes.append(previous_code)
+                last_symbols.append(first_symbol)
+                first_symbols.append(first_symbols[previous_code])
+                lengths.append(lengths[previous_code] + 1)
+                self.dict_size += 1
+            else:
+                if self.policy == RESET:
+                    res.append(self.write_phrases(phrases))
+                    phrases = []
+                    for table in (prefixes, last_symbols, first_symbols, lengths):
+                        del table[alphabet_size:]
+                    self.dict_size = alphabet_size
+                if code >= self.dict_size:
+                    raise ValueError(f'Invalid LZW code {code}')
+            phrases.append(code)
+            self.previous_code = code
+
+        res.append(self.write_phrases(phrases))
+        return np.concatenate(res)
+
+    def write_phrases(self, codes: List[int]) -> np.array:
+        '''
+        Writes out phrases of the codes of the current dictionary
+        '''
+        if not codes:
+            return np.array([], dtype='int64')
+        codes = np.array(codes, dtype='int64')
+        prefixes = np.frombuffer(self.prefixes, dtype='int64')
+        last_symbols = np.frombuffer(self.last_symbols, dtype='int64')
+        phrase_ends = np.cumsum(np.frombuffer(self.lengths, dtype='int64')[codes]) - 1
+
+        res = np.empty(phrase_ends[-1] + 1, dtype='int64')
+        current_codes, positions = codes, phrase_ends
+        while len(current_codes) != 0:
+            res[positions] = last_symbols[current_codes]
+            current_codes = prefixes[current_codes]
+            unfinished = current_codes >= 0
+            current_codes = current_codes[unfinished]
+            positions = positions[unfinished] - 1
+        return res
+
+    def feed(self, chunk) -> np.array:
+        '''
+        Adds a part of the stream written by Compressor, returns symbols
+        of all complete segments
+        '''
+        self.buffer += bytes(np.frombuffer(chunk, dtype='uint8'))
+        if not self.header_read:
+            if len(self.buffer) < STREAM_HEADER.size:
+                return np.array([], dtype='int64')
+            magic, alphabet_size, max_dict_size, policy = STREAM_HEADER.unpack_from(self.buffer)
+            if magic != STREAM_MAGIC:
+                raise ValueError('Not an LZW stream')
+            self.set_dictionary(alphabet_size, max_dict_size, POLICIES[policy])
+            self.buffer = self.buffer[STREAM_HEADER.size:]
+            self.header_read = True
 
-    dict_size: int = 256
-    mapping_dict: Dict[int, str] = {i: tuple([i]) for i in range(dict_size)}
+        res = [np.array([], dtype='int64')]
+        position = 0
+        while len(self.buffer) >= position + SEGMENT_HEADER.size:
+            (codes_num,) = SEGMENT_HEADER.unpack_from(self.buffer, position)
+            widths = code_widths(
+                codes_num, self.alphabet_size, self.max_dict_size, self.policy, self.codes_num
+            )
+            codes_start = position + SEGMENT_HEADER.size
+            segment_end = codes_start + (int(widths.sum()) + 7) // 8
+            if len(self.buffer) < segment_end:
+                break
+            payload = np.frombuffer(
+                self.buffer, dtype='uint8', count=segment_end - codes_start, offset=codes_start
+            )
+            codes = unpack_codes(payload, widths)
+            res.append(self.decode_codes(codes))
+            self.codes_num += codes_num
+            position = segment_end
+        self.buffer = self.buffer[position:]
+        return np.concatenate(res)
 
-    res: List[int] = []
-    compressed = compressed.tolist()
-    current_word: int = compressed.pop(0)
+    def flush(self) -> np.array:
+        if self.buffer:
+            raise ValueError('LZW stream ends in the middle of a segment')
+        return np.array([], dtype='int64')
 
-    res += [current_word]
-    for num in compressed:
-        if num in mapping_dict:
-            entry = mapping_dict[num]
-        else:
-            entry = tuple([*current_word, current_word[0]]) if not isinstance(current_word, int) \
-                                                        else tuple([current_word, current_word])
-        res += entry
-        try:
-            mapping_dict[dict_size] = tuple([*current_word, entry[0]])
-        except TypeError:
-            mapping_dict[dict_size] = tuple([current_word, entry[0]])
 
-        current_word = entry
-        dict_size += 1
+def lzw_codes(
+        data: np.array, alphabet_size: int=256,
+        max_dict_size: Optional[int]=None, policy: str=RESET
+    ) -> np.array:
+    '''
+    Compresses an array of symbols from [0, alphabet_size) into LZW codes
+    '''
+    compressor = Compressor(alphabet_size, max_dict_size, policy)
+    return np.array(compressor.encode(data) + compressor.finish(), dtype='int64')
+
+
+def lzw_compress(
+        data: np.array, alphabet_size: int=256,
+        max_dict_size: Optional[int]=None, policy: str=RESET
+    ) -> np.array:
+    '''
+    Compresses an array of symbols into LZW codes packed at the current
+    code width, prefixed with a header describing the dictionary
+    '''
+    max_dict_size = dict_size_limit(alphabet_size, max_dict_size)
+    codes = lzw_codes(data, alphabet_size, max_dict_size, policy)
+    with metrics.timer('lzw.pack'):
+        packed, _ = pack_codes(
+            codes, code_widths(len(codes), alphabet_size, max_dict_size, policy)
+        )
+    header = HEADER.pack(MAGIC, alphabet_size, max_dict_size, POLICIES.index(policy), len(codes))
+    return np.concatenate([np.frombuffer(header, dtype='uint8'), packed])
+
+
+def encode_packet(data: np.array, level=None) -> bytes:
+    '''
+    Compresses the array into the payload of a container packet. Symbols
+    must be non-negative, bytes use an alphabet of 256 symbols, larger
+    ones an alphabet of 2 ** 16. LZW has no levels
+    '''
+    data = np.asarray(data).ravel()
+    alphabet_size = 256 if len(data) == 0 or data.max() < 256 else 1 << 16
+    return lzw_compress(data, alphabet_size).tobytes()
+
+
+def decode_packet(payload) -> np.array:
+    '''
+    Decompresses the payload of a container packet
+    '''
+    return lzw_decompress(np.frombuffer(payload, dtype='uint8'))
+
+
+def decode_legacy_packet(stored) -> np.array:
+    '''
+    Decompresses codes stored in np.savez_compressed archives of older versions
+    '''
+    return lzw_decompress(stored)
+
+
+def decode_codes(
+        codes: np.array, alphabet_size: int=256,
+        max_dict_size: Optional[int]=None, policy: str=RESET
+    ) -> np.array:
+    '''
+    Decompresses LZW codes into an array of symbols
+    '''
+    return Decompressor(alphabet_size, max_dict_size, policy).decode_codes(codes)
+
+
+def lzw_decompress(compressed: np.array, alphabet_size: int=256) -> np.array:
+    '''
+    Decompresses packed LZW codes or an LZW stream into an array of symbols.
+    Arrays of plain (unpacked) codes are decoded with an unbounded dictionary
+    of the given alphabet size
+    '''
+    compressed = np.asarray(compressed)
+    magic = compressed[:len(MAGIC)].tobytes() if compressed.dtype == np.uint8 else None
+    if magic == STREAM_MAGIC:
+        decompressor = Decompressor()
+        res = decompressor.feed(compressed)
+        decompressor.flush()
+        return res
+    if magic != MAGIC:
+        return decode_codes(compressed, alphabet_size, None)
 
-    return np.array(res)
+    _, alphabet_size, max_dict_size, policy, codes_num = HEADER.unpack(
+        compressed[:HEADER.size].tobytes()
+    )
+    policy = POLICIES[policy]
+    codes = unpack_codes(
+        compressed[HEADER.size:], code_widths(codes_num, alphabet_size, max_dict_size, policy)
+    )
+    return decode_codes(codes, alphabet_size, max_dict_size, policy)
 
 
 if __name__ == '__main__':
@@ -63,23 +388,19 @@ if __name__ == '__main__':
     # Usage with text
     # --------------------------------------------------------------------------------
     ascii_msg = [ord(elm) for elm in 'Sed ut perspiciatis, unde omnis iste natus error sit voluptatem accusantium doloremque laudantium, totam rem aperiam eaque ipsa, quae ab illo inventore veritatis et quasi architecto beatae vitae dicta sunt, explicabo. Nemo enim ipsam voluptatem, quia voluptas sit, aspernatur aut odit aut fugit, sed quia consequuntur magni dolores eos, qui ratione voluptatem sequi nesciunt, neque porro quisquam est, qui dolorem ipsum, quia dolor sit, amet, consectetur, adipisci velit, sed quia non numquam eius modi tempora incidunt, ut labore et dolore magnam aliquam quaerat voluptatem. Ut enim ad minima veniam, quis nostrum exercitationem ullam corporis suscipit laboriosam, nisi ut aliquid ex ea commodi consequatur? Quis autem vel eum iure reprehenderit, qui in ea voluptate velit esse, quam nihil molestiae consequatur, vel illum, qui dolorem eum fugiat, quo voluptas nulla pariatur? [33] At vero eos et accusamus et iusto odio dignissimos ducimus, qui blanditiis praesentium voluptatum deleniti atque corrupti, quos dolores et quas molestias excepturi sint, obcaecati cupiditate non provident, similique sunt in culpa, qui officia deserunt mollitia animi, id est laborum et dolorum fuga. Et harum quidem rerum facilis est et expedita distinctio. Nam libero tempore, cum soluta nobis est eligendi optio, cumque nihil impedit, quo minus id, quod maxime placeat, facere possimus, omnis voluptas assumenda est, omnis dolor repellendus. Temporibus autem quibusdam et aut officiis debitis aut rerum necessitatibus saepe eveniet, ut et voluptates repudiandae sint et molestiae non recusandae. Itaque earum rerum hic tenetur a sapiente delectus, ut aut reiciendis voluptatibus maiores alias consequatur aut perferendis doloribus asperiores repellat.']
-    from time import time
-    start_time = time()
     compressed = lzw_compress(np.array(ascii_msg))
     decompressed = lzw_decompress(compressed)
     assert list(decompressed) == list(ascii_msg)
-    print(f'Compression and decompression has taken {time() - start_time}')
+    print(f'Text of {len(ascii_msg)} symbols compressed into {len(compressed)} bytes')
 
     # --------------------------------------------------------------------------------
     # Usage with image
     # --------------------------------------------------------------------------------
     from PIL import Image
-    np.set_printoptions(threshold=np.inf)
-    img = Image.open('examples/test_img.png').convert('RGB')
-    img = np.array(img.getdata())
-    img = np.ravel(img)
-    start_time = time()
+    img = Image.open('examples/image.png').convert('RGB')
+    img = np.ravel(np.array(img, dtype='uint8'))
     compressed = lzw_compress(img)
     decompressed = lzw_decompress(compressed)
-    print(f'Compression and decompression has taken {time() - start_time}')
+    print(f'Image of {len(img)} bytes compressed into {len(compressed)} bytes')
     assert np.all(img == decompressed)
+    # speed and ratio of every codec: python3 src/benchmark.py
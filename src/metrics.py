@@ -0,0 +1,220 @@
+'''
+Opt-in timers and counters of the conversion and playback stages.
+
+Metrics are off by default and then cost one flag check per call. After
+enable() every timer() block adds its wall time to the stage and count()
+and maximum() record codec statistics:
+
+    metrics.enable()
+    with metrics.timer('lz77.match_search'):
+        ...
+    metrics.count('lz77.tokens', len(tokens))
+    print(metrics.summary())
+
+Stages nest (an encode includes its match search), so their times overlap.
+Work done in pool processes is measured there: functions wrapped with
+collect() return their metrics with the result and unwrap() adds them to
+the metrics of the calling process.
+'''
+
+import json
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Callable, Iterable, Iterator
+
+enabled = False
+# stage -> [seconds, calls]
+timers = defaultdict(lambda: [0., 0])
+counters = defaultdict(int)
+maxima = {}
+
+
+def enable(on: bool=True) -> None:
+    global enabled
+    enabled = on
+
+
+def reset() -> None:
+    timers.clear()
+    counters.clear()
+    maxima.clear()
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    '''
+    Adds wall time of the block to the stage
+    '''
+    if not enabled:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        stage_timer = timers[stage]
+        stage_timer[0] += perf_counter() - start
+        stage_timer[1] += 1
+
+
+def timed_iter(stage: str, iterable: Iterable) -> Iterator:
+    '''
+    Yields items of the iterable, adding the time taken to produce each of
+    them to the stage
+    '''
+    iterator = iter(iterable)
+    while True:
+        with timer(stage):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def count(name: str, value: int=1) -> None:
+    if enabled:
+        counters[name] += value
+
+
+def maximum(name: str, value) -> None:
+    if enabled and (name not in maxima or value > maxima[name]):
+        maxima[name] = value
+
+
+def snapshot() -> dict:
+    '''
+    Returns the raw metrics, which merge() can add to another process
+    '''
+    return {
+        'timers': {stage: list(value) for stage, value in timers.items()},
+        'counters': dict(counters),
+        'maxima': dict(maxima),
+    }
+
+
+def merge(other: dict) -> None:
+    for stage, (seconds, calls) in other['timers'].items():
+        timers[stage][0] += seconds
+        timers[stage][1] += calls
+    for name, value in other['counters'].items():
+        counters[name] += value
+    for name, value in other['maxima'].items():
+        maximum(name, value)
+
+
+class Collected:
+    '''
+    Picklable wrapper running func with metrics enabled (in a pool process),
+    returns (result, metrics of the call)
+    '''
+
+    def __init__(self, func: Callable) -> None:
+        self.func = func
+
+    def __call__(self, *args, **kwargs) -> tuple:
+        enable()
+        reset()
+        result = self.func(*args, **kwargs)
+        return result, snapshot()
+
+
+def collect(func: Callable) -> Callable:
+    '''
+    Wraps func sent to another process when metrics are enabled
+    '''
+    return Collected(func) if enabled else func
+
+
+def unwrap(result):
+    '''
+    Returns the result of a function wrapped by collect(), merging its metrics
+    '''
+    if not enabled:
+        return result
+    result, other = result
+    merge(other)
+    return result
+
+
+def ratio(numerator: str, denominator: str):
+    if counters.get(denominator):
+        return counters.get(numerator, 0) / counters[denominator]
+    return None
+
+
+def codec_stats() -> dict:
+    '''
+    Statistics derived from the counters, None where the codec was not used
+    '''
+    return {
+        'compression_ratio': ratio('encode.bytes_in', 'encode.bytes_out'),
+        'lz77.average_match_length': ratio('lz77.match_symbols', 'lz77.matches'),
+        'lz77.literal_ratio': ratio('lz77.literals', 'lz77.tokens'),
+        'lz77.symbols_per_token': ratio('lz77.symbols', 'lz77.tokens'),
+        'huffman.bits_per_symbol': ratio('huffman.bits', 'huffman.symbols'),
+        'lzw.symbols_per_code': ratio('lzw.symbols', 'lzw.codes'),
+        'lzw.dictionary_size': maxima.get('lzw.dictionary_size'),
+        'deflate.stored_ratio': ratio('deflate.stored_blocks', 'deflate.blocks'),
+    }
+
+
+def report() -> dict:
+    return {
+        'timers': {
+            stage: {'seconds': seconds, 'calls': calls}
+            for stage, (seconds, calls) in sorted(timers.items())
+        },
+        'counters': dict(sorted(counters.items())),
+        'maxima': dict(sorted(maxima.items())),
+        'codec_stats': {name: value for name, value in codec_stats().items() if value is not None},
+    }
+
+
+def summary() -> str:
+    '''
+    Returns the report as a table
+    '''
+    data = report()
+    lines = [f"{'stage':<32} {'calls':>8} {'total s':>10} {'mean ms':>10}"]
+    for stage, value in data['timers'].items():
+        lines.append(
+            f"{stage:<32} {value['calls']:>8} {value['seconds']:>10.3f} "
+            f"{value['seconds'] / max(value['calls'], 1) * 1000:>10.3f}"
+        )
+    for name, value in {**data['counters'], **data['maxima'], **data['codec_stats']}.items():
+        value = f'{value:.3f}' if isinstance(value, float) else value
+        lines.append(f'{name:<32} {value:>22}')
+    return '\n'.join(lines)
+
+
+def dump(path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(report(), file, indent=2)
+
+
+def add_arguments(parser) -> None:
+    '''
+    Adds the metrics options to a command line parser
+    '''
+    parser.add_argument(
+        '--metrics', choices=['table', 'json'],
+        help='print time of every stage and codec statistics at the end'
+    )
+    parser.add_argument('--metrics-file', help='write the metrics as JSON to the file')
+
+
+def enable_from(args) -> None:
+    enable(bool(args.metrics or args.metrics_file))
+
+
+def output(args) -> None:
+    '''
+    Prints or writes the metrics as asked by the command line options
+    '''
+    if args.metrics == 'table':
+        print(summary())
+    elif args.metrics == 'json':
+        print(json.dumps(report(), indent=2))
+    if args.metrics_file:
+        dump(args.metrics_file)
@@ -0,0 +1,164 @@
+'''
+Helpers for running independent jobs (frames, packets) on a process pool
+and handing their results over between threads.
+'''
+
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Iterable, Iterator, Optional
+import metrics
+
+
+def ordered_map(
+        func: Callable, iterable: Iterable, workers: int=1, max_pending: Optional[int]=None
+    ) -> Iterator:
+    '''
+    Lazily applies func to items of the iterable on a pool of workers and
+    yields the results in the order of the items.
+
+    At most max_pending items (twice the number of workers by default) are
+    taken from the iterable ahead of the results consumed, so a slow consumer
+    holds back the producer instead of piling up results in memory.
+    With one worker the items are processed in the calling process.
+    Metrics of the workers are added to the metrics of the calling process.
+    '''
+    if workers <= 1:
+        yield from map(func, iterable)
+        return
+
+    max_pending = max_pending or 2 * workers
+    func = metrics.collect(func)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield metrics.unwrap(pending.popleft().result())
+        while pending:
+            yield metrics.unwrap(pending.popleft().result())
+
+
+class RingBuffer:
+    '''
+    Fixed number of preallocated slots, filled in order by a producer thread
+    and drained by a consumer that must never wait (an audio callback).
+
+    put() blocks while all slots are full, so the producer runs at most
+    `slots` items ahead. get() returns immediately; when the buffer is empty
+    before the producer has finished, it counts an underrun.
+    '''
+
+    def __init__(self, slots: int, shape: tuple, dtype='float32') -> None:
+        self.data = np.zeros((slots, *shape), dtype=dtype)
+        self.lengths = np.zeros(slots, dtype='int64')
+        self.read_count = 0
+        self.write_count = 0
+        self.closed = False
+        self.underruns = 0
+        self.condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return self.write_count - self.read_count
+
+    def put(self, item: np.array) -> None:
+        '''
+        Copies the item into the next free slot, waiting for one if needed
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: len(self) < len(self.data))
+        slot = self.write_count % len(self.data)
+        self.data[slot, :len(item)] = item
+        self.lengths[slot] = len(item)
+        with self.condition:
+            self.write_count += 1
+            self.condition.notify_all()
+
+    def get(self, out: np.array) -> int:
+        '''
+        Copies the oldest item into out and frees its slot. Returns the length
+        of the item, 0 if there is none
+        '''
+        if len(self) == 0:
+            if not self.closed:
+                self.underruns += 1
+            return 0
+        slot = self.read_count % len(self.data)
+        length = min(int(self.lengths[slot]), len(out))
+        out[:length] = self.data[slot, :length]
+        with self.condition:
+            self.read_count += 1
+            self.condition.notify_all()
+        return length
+
+    def wait_filled(self, count: int) -> None:
+        '''
+        Waits until count items are buffered or the producer has finished
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: len(self) >= count or self.closed)
+
+    def close(self) -> None:
+        '''
+        Marks that no more items will be put
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.closed and len(self) == 0
+
+
+# slots attached in this process, by shared memory name
+attached_slots = {}
+
+
+class SharedSlots:
+    '''
+    Preallocated arrays in shared memory that several processes write and
+    read in place. Pickling passes only the name of the memory block, the
+    receiving process attaches to it once and reuses the mapping.
+
+    The creating process owns the block and removes it on close().
+    '''
+
+    def __init__(self, slots: int, shape: tuple, dtype='uint8', name: Optional[str]=None) -> None:
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 1))
+        self.array = np.ndarray((slots, *self.shape), dtype=self.dtype, buffer=self.memory.buf)
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def __len__(self) -> int:
+        return self.slots
+
+    def __getitem__(self, slot: int) -> np.array:
+        return self.array[slot % self.slots]
+
+    def __reduce__(self):
+        return attach_slots, (self.name, self.slots, self.shape, self.dtype.str)
+
+    def close(self) -> None:
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def attach_slots(name: str, slots: int, shape: tuple, dtype: str) -> SharedSlots:
+    '''
+    Returns slots of the shared memory block, attaching to it on first use
+    '''
+    if name not in attached_slots:
+        attached_slots[name] = SharedSlots(slots, shape, dtype, name)
+    return attached_slots[name]
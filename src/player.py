@@ -1,21 +1,28 @@
 from concurrent.futures import ProcessPoolExecutor
-from lz77 import decompress as lz77_decompress
-from Huffman_algo import HuffmanCode
-from lzw import lzw_decompress
-from time import sleep, time
-from deflate import Deflate
-from mido import MidiFile
-import sounddevice as sd
-from cv2 import cv2
+from container import open_container, decode_payload
+from filters import unfilter_image
+from audio import decode_samples, from_symbols
+import metrics
+from pipeline import ordered_map, RingBuffer, SharedSlots
+from registry import get_codec, media_of
+from collections import deque
+from time import perf_counter
 import numpy as np
 import functools
+import threading
+import argparse
 import asyncio
-import sys
+
+# number of decompressed audio packets buffered ahead of playback
+DEFAULT_AUDIO_PREFETCH = 8
+# number of shared memory slots for decoded video frames
+DEFAULT_FRAME_SLOTS = 8
 
 def extract_wave_from_midi(filename='toccata.mid'):
     """
     extracts wave from midi (testing purposes)
     """
+    from mido import MidiFile
     bach = MidiFile(filename)
     sample_rate = 44100
 
@@ -59,155 +66,352 @@ def extract_wave_from_midi(filename='toccata.mid'):
 
     return wave
 
-def play_audio(path, debug=True):
+def decompress_audio_packet(package, metadata):
+    """
+    decompress (audio packet, its codec) into (samples, channels) floats
+    (in a separate process)
+    """
+    packet, codec = package
+    decompressed = decode_payload(codec, packet)
+    if get_codec(codec).nonnegative:
+        decompressed = from_symbols(decompressed)
+    with metrics.timer('audio.restore'):
+        samples = decode_samples(decompressed, metadata['channels'], metadata.get('stages', ()))
+    return (samples / metadata['peak']).astype('float32').reshape((-1, metadata['channels']))
+
+def play_audio(path, debug=True, workers=1, prefetch=DEFAULT_AUDIO_PREFETCH):
     """
     plays and decompresses audio concurrently
+
+    packets are decompressed by a pool of workers into a ring buffer of
+    prefetch packets, which the audio callback drains. playback starts as
+    soon as the first packet is ready. returns playback stats: underruns
+    counts packets the callback had to replace with silence
     """
-    audio_file = np.load(path, allow_pickle=True)['info']
-    audio_cur_ind = 0
-    def callback(outdata, frames, *_):
-        nonlocal audio_cur_ind, ready_audio
-        if debug:
-            print(f'ready {len(ready_audio) - 1} / playing {audio_cur_ind}', flush=True, end='     \r')
-        if audio_cur_ind >= len(ready_audio):
-            outdata[:] = np.zeros((frames, audio_file[1][1]), dtype='float32')
-            return
-        frame_num = len(ready_audio[audio_cur_ind])
-        if frame_num < frames:
-            outdata[:frame_num] = ready_audio[audio_cur_ind]
-            outdata[frame_num:] = np.zeros(frames - frame_num, dtype='float32')
-        else:
-            outdata[:] = ready_audio[audio_cur_ind]
-        ready_audio[audio_cur_ind] = None
-        audio_cur_ind += 1
-    transform = lambda buffer: (lz77_decompress(buffer) / audio_file[1][0]).reshape((audio_file[1][3], audio_file[1][1]))
-    ready_audio = [transform(audio_file[0][0])]
-    with sd.OutputStream(
-            callback=callback,
-            channels=audio_file[1][1],
-            samplerate=audio_file[1][2],
-            blocksize=audio_file[1][3]
-        ):
-        time_began = time()
-        ind = 0
-        for buffer in audio_file[0][1:]:
-            ind += 1
-            ready_audio.append(transform(buffer))
+    import sounddevice as sd
+    with open_container(path) as audio_file:
+        metadata = audio_file.metadata
+        packets_num = len(audio_file)
+        ready_audio = RingBuffer(max(prefetch, 1), (metadata['packet_size'], metadata['channels']))
+        audio_cur_ind = 0
+        finished = threading.Event()
+        # exception of the decoding thread, raised again in the caller
+        errors = []
+
+        def callback(outdata, frames, *_):
+            nonlocal audio_cur_ind
             if debug:
-                print(f'ready {len(ready_audio) - 1} / playing {audio_cur_ind}', flush=True, end='     \r')
-        sleep(audio_file[1][4] - (time() - time_began))
+                print(f'ready {len(ready_audio)} / playing {audio_cur_ind} / underruns {ready_audio.underruns}', flush=True, end='     \r')
+            frame_num = ready_audio.get(outdata)
+            outdata[frame_num:] = 0
+            if frame_num:
+                audio_cur_ind += 1
+            elif ready_audio.exhausted:
+                finished.set()
+
+        def prepare_audio():
+            try:
+                packets = (
+                    (audio_file.packet(ind), audio_file.codec(ind)) for ind in range(packets_num)
+                )
+                transform = functools.partial(decompress_audio_packet, metadata=metadata)
+                for decompressed in ordered_map(transform, packets, workers):
+                    ready_audio.put(decompressed)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                # playback ends with the packets decoded so far
+                ready_audio.close()
+
+        thread = threading.Thread(target=prepare_audio, daemon=True)
+        thread.start()
+        ready_audio.wait_filled(1)
+        if not errors:
+            with sd.OutputStream(
+                    callback=callback,
+                    channels=metadata['channels'],
+                    samplerate=metadata['rate'],
+                    blocksize=metadata['packet_size']
+                ):
+                finished.wait()
+        thread.join()
+        if errors:
+            raise errors[0]
+    if debug:
+        print()
+    metrics.count('audio.underruns', ready_audio.underruns)
+    return {'packets': audio_cur_ind, 'underruns': ready_audio.underruns}
 
 def show_image(path):
     """
     decompress and show image
     """
-    image_file = np.load(path, allow_pickle=True)['info']
-    if len(image_file) > 2:
-        if image_file[2].lower() == 'lzw':
-            decompressed = lzw_decompress(image_file[0])
-        elif image_file[2].lower() == 'deflate':
-            decompressed = Deflate().decode(image_file[0])
-        elif image_file[2].lower() == 'huffman':
-            decompressed = HuffmanCode(image_file[0][0]).decode(image_file[0][1])
+    from cv2 import cv2
+    with open_container(path) as image_file:
+        metadata = image_file.metadata
+        decompressed = image_file.read(0)
+    with metrics.timer('unfilter'):
+        if 'filters' in metadata:
+            image = unfilter_image(decompressed, metadata['shape'], metadata['filters'] == 'planar')
         else:
-            decompressed = lz77_decompress(image_file[0])
-    else:
-        decompressed = lz77_decompress(image_file[0])
-    image = np.reshape(decompressed, image_file[1])
+            image = np.reshape(decompressed, metadata['shape']).astype('uint8')
     print("Press any key to exit...")
-    cv2.imshow('image', image)
+    with metrics.timer('display'):
+        cv2.imshow('image', image)
     cv2.waitKey(0)
 
 def cv2_create_window(winname):
     """
     create a named video (in the main thread separate process)
     """
+    from cv2 import cv2
     cv2.namedWindow(winname)
 
 def cv2_rgb_image_show(winname, img_rgb, wait_time):
     """
     update image in named window (in the main thread separate process)
     """
+    from cv2 import cv2
     cv2.imshow(winname, cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR))
     cv2.waitKey(wait_time)
 
-def decompress_frame(frame, metadata):
+def cv2_rgb_slot_show(winname, frame_slots, slot, wait_time):
+    """
+    update image in named window with the frame in shared memory slot
+    (in the main thread separate process)
+    """
+    cv2_rgb_image_show(winname, frame_slots[slot], wait_time)
+
+def decompress_frame(frame, metadata, codec):
     """
     decompress frames (in the main thread separate process)
     """
-    ret = lz77_decompress(frame).reshape(metadata[1:])
+    ret = decode_payload(codec, frame).reshape(metadata['shape']).astype('uint8')
     return ret
 
-def play_video(path, debug=True):
+def decompress_frame_into(frame, metadata, codec, frame_slots, slot):
+    """
+    decompress frame into shared memory slot (in a separate process),
+    returns the time it took
+    """
+    time_began = perf_counter()
+    frame_slots[slot][...] = decode_payload(codec, frame).reshape(metadata['shape'])
+    return perf_counter() - time_began
+
+def reconstruct_frame(decompressed, previous, keyframe):
+    """
+    restores inter frames, stored as xor with the previous frame
+    """
+    if keyframe:
+        return decompressed
+    return np.bitwise_xor(decompressed, previous, out=decompressed)
+
+def play_video(path, debug=True, start_frame=0, seek=None, slots=DEFAULT_FRAME_SLOTS, decoders=2):
     """
     plays and decompresses video concurrently (omg thread-safe)
+
+    playback begins at start_frame or at seek seconds from the beginning.
+    decoding begins at the last keyframe before it, frames in between are
+    decoded but not shown
+
+    frames live in a fixed number of shared memory slots: decoder processes
+    write them in place and the display process reads them from there, so
+    frames are never pickled. a slot is reused once a later frame was shown
+
+    playback follows the clock: every frame has its presentation time and
+    the newest decoded frame due is shown, the ones before it are dropped.
+    when decoding falls behind past a keyframe, frames before that keyframe
+    are not decoded at all. the number of frames decoded ahead starts at the
+    number of decoders and grows each time a frame is late.
+    returns playback stats
     """
-    video_file = np.load(path, allow_pickle=True)['info']
-    metadata = video_file[1].astype(int)
-    frame_rate = metadata[0]
-    
-    frames_num = len(video_file[0])
-
-    ready_frames = [decompress_frame(video_file[0][0], metadata)]  # preload 1 frame
-    ready_frames_lock = asyncio.Lock()
-
-    main_thread_cv2_executor = ProcessPoolExecutor(1)
-    main_thread_decompress_executor = ProcessPoolExecutor(2)
-    loop = asyncio.get_event_loop()
-
-    async def play_video_in_main_thread(loop):
-        current_frame_index = 0
-        wait_time = 1 / frame_rate
-
-        await loop.run_in_executor(main_thread_cv2_executor, functools.partial(cv2_create_window, winname="video"))
-
-        image = np.zeros(metadata[1:]).astype('uint8')
-
-        while current_frame_index < frames_num:
-            if debug and current_frame_index % 10 == 0:
-                print(f'ready {len(ready_frames)} / playing {current_frame_index}', flush=True, end='     \r')
-            async with ready_frames_lock:
-                if current_frame_index < len(ready_frames):
-                    image = ready_frames[current_frame_index]
-                    current_frame_index += 1
-            await loop.run_in_executor(
-                main_thread_cv2_executor,
-                functools.partial(
-                    cv2_rgb_image_show, winname='video',
-                    img_rgb=image, wait_time=int(max(wait_time, 0.001) * 1000)
-                )
+    with open_container(path) as video_file:
+        metadata = video_file.metadata
+        frame_rate = metadata['rate']
+
+        frames_num = len(video_file)
+        if seek is not None:
+            start_frame = int(seek * frame_rate)
+        start_frame = min(max(start_frame, 0), frames_num - 1)
+        decode_frame = video_file.keyframe_before(start_frame)
+
+        # the shown frame, the one after it (previous for xor) and the frames decoded ahead
+        frame_slots = SharedSlots(max(slots, decoders + 2), metadata['shape'])
+        frame = None
+        for ind in range(decode_frame, start_frame + 1):  # preload 1 frame
+            frame = reconstruct_frame(
+                decompress_frame(video_file.packet(ind), metadata, video_file.codec(ind)),
+                frame, video_file.is_keyframe(ind)
             )
+        frame_slots[0][...] = frame
+
+        # decoded frames not passed by playback yet: frame index -> decoding order,
+        # which is also the slot number modulo number of slots
+        decoded = {start_frame: 0}
+        decoded_num = 1
+        ready_frames_num = start_frame + 1
+        shown_frame, shown_order = start_frame - 1, 0
+        prefetch = decoders
+        clock_start = None
+        frames_changed = asyncio.Condition()
+        stats = {
+            'shown': 0, 'dropped': 0, 'skipped': 0, 'late': 0,
+            'decode_time': 0., 'max_decode_time': 0., 'occupancy': 0., 'max_occupancy': 0,
+        }
 
-    async def prepare_frames(loop):
-        for frame in video_file[0][1:]:
-            result = await loop.run_in_executor(
-                main_thread_decompress_executor, functools.partial(decompress_frame, frame=frame, metadata=metadata)
+        def due_frame():
+            """
+            the frame that should be on screen now
+            """
+            if clock_start is None:
+                return start_frame
+            return min(
+                start_frame + int((perf_counter() - clock_start) * frame_rate), frames_num - 1
             )
-            async with ready_frames_lock:
-                ready_frames.append(result)
 
-    async def run_loop(loop):
-        await asyncio.gather(
-            asyncio.create_task(play_video_in_main_thread(loop)),
-            asyncio.create_task(prepare_frames(loop))
-        )
+        main_thread_cv2_executor = ProcessPoolExecutor(1)
+        main_thread_decompress_executor = ProcessPoolExecutor(decoders)
+        loop = asyncio.get_event_loop()
+
+        async def play_video_in_main_thread(loop):
+            nonlocal shown_frame, shown_order, prefetch, clock_start
+            late_frame = None
+
+            await loop.run_in_executor(main_thread_cv2_executor, functools.partial(cv2_create_window, winname="video"))
+            clock_start = perf_counter()
 
-    loop.run_until_complete(run_loop(loop))
+            while True:
+                async with frames_changed:
+                    due = due_frame()
+                    newest = max((ind for ind in decoded if shown_frame < ind <= due), default=None)
+                    if newest is not None:
+                        stats['dropped'] += newest - shown_frame - 1
+                        shown_frame, shown_order = newest, decoded[newest]
+                        for ind in [ind for ind in decoded if ind < shown_frame]:
+                            del decoded[ind]
+                        frames_changed.notify_all()
+                    elif due > shown_frame and late_frame != shown_frame + 1:
+                        late_frame = shown_frame + 1
+                        stats['late'] += 1
+                        prefetch = min(prefetch + 1, len(frame_slots) - 1)
+                    ahead = len(decoded) - 1
+
+                if debug and newest is not None and newest % 10 == 0:
+                    print(f'ready {ready_frames_num} / playing {shown_frame}', flush=True, end='     \r')
+                if newest is not None:
+                    stats['shown'] += 1
+                    stats['occupancy'] += ahead
+                    stats['max_occupancy'] = max(stats['max_occupancy'], ahead)
+                    with metrics.timer('display'):
+                        await loop.run_in_executor(
+                            main_thread_cv2_executor,
+                            functools.partial(
+                                cv2_rgb_slot_show, winname='video', frame_slots=frame_slots,
+                                slot=shown_order, wait_time=1
+                            )
+                        )
+
+                # sleep until the next frame is due or, if it is late, until it is decoded
+                next_time = clock_start + (shown_frame + 1 - start_frame) / frame_rate
+                if shown_frame == frames_num - 1:
+                    await asyncio.sleep(max(next_time - perf_counter(), 0))
+                    break
+                async with frames_changed:
+                    try:
+                        await asyncio.wait_for(
+                            frames_changed.wait(), max(next_time - perf_counter(), 0.001)
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+
+        async def prepare_frames(loop):
+            nonlocal ready_frames_num, decoded_num
+            pending = deque()
+            ind = start_frame + 1
+            while ind < frames_num or pending:
+                if ind < frames_num and len(pending) < decoders:
+                    # frames already late are not decoded if a keyframe after them is due
+                    keyframe = video_file.keyframe_before(due_frame())
+                    if keyframe > ind:
+                        stats['skipped'] += keyframe - ind
+                        ind = keyframe
+                    async with frames_changed:
+                        await frames_changed.wait_for(lambda: decoded_num - shown_order <= prefetch)
+                    pending.append((ind, decoded_num, loop.run_in_executor(
+                        main_thread_decompress_executor, metrics.collect(functools.partial(
+                            decompress_frame_into, frame=video_file.packet(ind), metadata=metadata,
+                            codec=video_file.codec(ind), frame_slots=frame_slots, slot=decoded_num
+                        ))
+                    )))
+                    decoded_num += 1
+                    ind += 1
+                    continue
+
+                frame_ind, order, result = pending.popleft()
+                decode_time = metrics.unwrap(await result)
+                stats['decode_time'] += decode_time
+                stats['max_decode_time'] = max(stats['max_decode_time'], decode_time)
+                if not video_file.is_keyframe(frame_ind):
+                    with metrics.timer('reconstruct'):
+                        reconstruct_frame(
+                            frame_slots[order], frame_slots[decoded[frame_ind - 1]], False
+                        )
+                async with frames_changed:
+                    decoded[frame_ind] = order
+                    ready_frames_num = frame_ind + 1
+                    frames_changed.notify_all()
+
+        async def run_loop(loop):
+            await asyncio.gather(
+                asyncio.create_task(play_video_in_main_thread(loop)),
+                asyncio.create_task(prepare_frames(loop))
+            )
+
+        try:
+            loop.run_until_complete(run_loop(loop))
+        finally:
+            main_thread_cv2_executor.shutdown()
+            main_thread_decompress_executor.shutdown()
+            frame_slots.close()
+
+    decoded_frames = decoded_num - 1
+    stats['decode_time'] /= max(decoded_frames, 1)
+    stats['occupancy'] /= max(stats['shown'], 1)
+    for key in ('shown', 'dropped', 'skipped', 'late'):
+        metrics.count(f'video.{key}', stats[key])
+    if debug:
+        print(
+            f"\nshown {stats['shown']}, dropped {stats['dropped']} (not decoded {stats['skipped']}), "
+            f"late {stats['late']}, decode {stats['decode_time'] * 1000:.1f} ms avg / "
+            f"{stats['max_decode_time'] * 1000:.1f} ms max, "
+            f"buffered {stats['occupancy']:.1f} avg / {stats['max_occupancy']} max frames"
+        )
+    return stats
 
-def play(path):
+def play(path, start_frame=0, seek=None, workers=1, prefetch=DEFAULT_AUDIO_PREFETCH):
     """
     play the specified file
     """
     res_dict = {
-        "bzbv": play_video,
-        "bzbi": show_image,
-        "bzba": play_audio
+        "video": functools.partial(play_video, start_frame=start_frame, seek=seek),
+        "image": show_image,
+        "audio": functools.partial(play_audio, workers=workers, prefetch=prefetch)
     }
-    res_dict[path.split('.')[-1]](path)
+    res_dict[media_of(path).name](path)
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        play(sys.argv[1])
-    else:
-        print(f"Usage: {sys.argv[0]} file[.bzba|.bzbv|.bzbi]")
+    parser = argparse.ArgumentParser(description='Play file[.bzba|.bzbv|.bzbi]')
+    parser.add_argument('file')
+    parser.add_argument('--start-frame', type=int, default=0, help='video frame to start playing from')
+    parser.add_argument('--seek', type=float, help='video timestamp in seconds to start playing from')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes decompressing audio')
+    parser.add_argument(
+        '--prefetch', type=int, default=DEFAULT_AUDIO_PREFETCH,
+        help='number of audio packets decompressed ahead of playback'
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.enable_from(args)
+    play(args.file, args.start_frame, args.seek, args.workers, args.prefetch)
+    metrics.output(args)
 
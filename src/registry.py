@@ -0,0 +1,118 @@
+'''
+Registry of codecs and media types.
+
+A codec is a module with three functions, imported the first time the
+codec is used:
+
+    encode_packet(data, level) -> bytes     payload of a container packet
+    decode_packet(payload) -> np.array
+    decode_legacy_packet(stored) -> np.array  codec output stored by older versions
+
+so a command loads only the codec it works with, and a new codec plugs in
+with one register_codec() call. Media types map the extensions of the
+files convert.py reads and of the containers it writes to image, video or
+audio.
+
+The Compressor and Decompressor classes of the codec modules compress a
+stream fed in chunks. They are a library API, not used by convert.py and
+player.py: packets are compressed independently, so workers code them in
+parallel and the player seeks and drops frames without decoding the
+packets before them.
+'''
+
+import os
+import importlib
+from typing import Dict, NamedTuple, Tuple
+
+# compression levels of the codecs that have them (lz77 and deflate),
+# 1 is fastest, 9 compresses best
+COMPRESSION_LEVELS = tuple(range(1, 10))
+DEFAULT_LEVEL = 5
+
+
+class Codec:
+    '''
+    Codec implemented by a module, imported on first use
+
+    Attributes
+    ----------
+    name: str
+        name stored in the container metadata
+    module_name: str
+        module with encode_packet, decode_packet and decode_legacy_packet
+    nonnegative: bool
+        whether the codec takes only non-negative symbols, signed samples
+        are shifted before encoding
+    '''
+
+    def __init__(self, name: str, module_name: str, nonnegative: bool=False) -> None:
+        self.name = name
+        self.module_name = module_name
+        self.nonnegative = nonnegative
+
+    @property
+    def module(self):
+        return importlib.import_module(self.module_name)
+
+    def encode(self, data, level: int) -> bytes:
+        return self.module.encode_packet(data, level)
+
+    def decode(self, payload):
+        return self.module.decode_packet(payload)
+
+    def decode_legacy(self, stored):
+        return self.module.decode_legacy_packet(stored)
+
+
+class Media(NamedTuple):
+    name: str
+    # extensions of the files converted into this media
+    sources: Tuple[str, ...]
+    # extension of the container file
+    extension: str
+
+
+CODECS: Dict[str, Codec] = {}
+MEDIA: Dict[str, Media] = {}
+
+
+def register_codec(name: str, module_name: str, nonnegative: bool=False) -> None:
+    CODECS[name] = Codec(name, module_name, nonnegative)
+
+
+def register_media(name: str, sources: Tuple[str, ...], extension: str) -> None:
+    MEDIA[name] = Media(name, tuple(sources), extension)
+
+
+def get_codec(name: str) -> Codec:
+    '''
+    Returns the codec of the given name, raises ValueError if it is unknown
+    '''
+    codec = CODECS.get(name.lower())
+    if codec is None:
+        raise ValueError(
+            f"Unsupported compression. One of the following is supported: {', '.join(CODECS)}"
+        )
+    return codec
+
+
+def media_of(path: str) -> Media:
+    '''
+    Returns the media of a source file or a container file by its extension,
+    raises ValueError if it is unknown
+    '''
+    extension = os.path.splitext(path)[1][1:].lower()
+    for media in MEDIA.values():
+        if extension in media.sources or extension == media.extension:
+            return media
+    raise ValueError('Currently unsupported file.')
+
+
+register_codec('lz77', 'lz77')
+register_codec('lzw', 'lzw', nonnegative=True)
+register_codec('huffman', 'Huffman_algo')
+register_codec('deflate', 'deflate')
+
+register_media('image', ('png', 'jpg'), 'bzbi')
+register_media('video', ('mp4', 'mov'), 'bzbv')
+register_media('audio', ('mp3',), 'bzba')
@@ -0,0 +1,117 @@
+'''
+Automatic choice of the codec of every packet.
+
+The packet (an image, a video frame or an audio packet) is compressed and
+decompressed with every candidate codec, and the policy picks one from
+the results:
+
+    ratio   the best compression ratio
+    decode  the fastest decompression among the codecs that compress the
+            sample at all, the best ratio if none does
+    budget  the best ratio among the codecs that compress and decompress
+            within the time budget (seconds per MB), the fastest if none does
+
+Packets up to WHOLE_PACKET_SIZE bytes (and any packet when no sample size
+is given, as for images) are tried whole and the payload of the chosen
+codec is kept. Of larger packets only a contiguous sample from their
+middle is tried, so the choice costs a fraction of compressing the
+packet with every codec. The sample is contiguous because LZW needs the
+data to build its dictionary, and joins of separate windows break matches
+of every codec. Ratios are of the payloads as they are stored, that is
+after store(payload) if it is given (zlib of the container).
+'''
+
+import numpy as np
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+import metrics
+
+RATIO = 'ratio'
+DECODE = 'decode'
+BUDGET = 'budget'
+POLICIES = (RATIO, DECODE, BUDGET)
+# packets tried whole by every candidate
+WHOLE_PACKET_SIZE = 1 << 18
+# bytes of larger packets tried by every candidate
+DEFAULT_SAMPLE_SIZE = 1 << 16
+# seconds to compress and decompress a megabyte under the budget policy
+DEFAULT_TIME_BUDGET = 1.
+MB = 1 << 20
+
+
+def sample(data: np.array, size: Optional[int]=DEFAULT_SAMPLE_SIZE) -> np.array:
+    '''
+    Returns size bytes from the middle of the data, the whole data if size
+    is None or the data is not larger than WHOLE_PACKET_SIZE
+    '''
+    flat = np.asarray(data).ravel()
+    if size is None or flat.nbytes <= max(size, WHOLE_PACKET_SIZE):
+        return flat
+    length = max(size // flat.itemsize, 1)
+    start = (len(flat) - length) // 2
+    return flat[start:start + length]
+
+
+def trial(codec, data: np.array, encode: Callable, store: Optional[Callable]=None) -> dict:
+    '''
+    Compresses and decompresses the data with the codec, returns the
+    stored (payload, flags), ratio and seconds per MB of compression and
+    decompression
+    '''
+    start = perf_counter()
+    payload = encode(codec, data)
+    encoded = perf_counter()
+    codec.decode(payload)
+    decoded = perf_counter()
+    stored = (payload, 0) if store is None else store(payload)
+    megabytes = max(data.nbytes, 1) / MB
+    return {
+        'codec': codec.name,
+        'stored': stored,
+        'ratio': data.nbytes / max(len(stored[0]), 1),
+        'encode_seconds': (encoded - start) / megabytes,
+        'decode_seconds': (decoded - encoded) / megabytes,
+    }
+
+
+def choose(trials: List[dict], policy: str=RATIO, time_budget: float=DEFAULT_TIME_BUDGET) -> str:
+    '''
+    Returns the name of the codec the policy picks from the trials
+    '''
+    best_ratio = max(trials, key=lambda result: result['ratio'])
+    if policy == RATIO:
+        return best_ratio['codec']
+    if policy == DECODE:
+        compressing = [result for result in trials if result['ratio'] > 1]
+        if not compressing:
+            return best_ratio['codec']
+        return min(compressing, key=lambda result: result['decode_seconds'])['codec']
+    if policy == BUDGET:
+        total = lambda result: result['encode_seconds'] + result['decode_seconds']
+        within = [result for result in trials if total(result) <= time_budget]
+        if not within:
+            return min(trials, key=total)['codec']
+        return max(within, key=lambda result: result['ratio'])['codec']
+    raise ValueError(f'Codec selection policy must be one of {POLICIES}')
+
+
+def choose_codec(
+        data: np.array, codecs: list, encode: Callable, policy: str=RATIO,
+        time_budget: float=DEFAULT_TIME_BUDGET, sample_size: Optional[int]=DEFAULT_SAMPLE_SIZE,
+        store: Optional[Callable]=None
+    ) -> Tuple[str, Optional[tuple]]:
+    '''
+    Returns the name of the codec the policy picks for the data out of the
+    codecs and the stored (payload, flags) of the data if it was tried whole
+    (None if only a sample was). encode(codec, data) returns packet payload
+    of the data, store(payload) returns the payload as it is stored and its flags
+    '''
+    if len(codecs) == 1:
+        return codecs[0].name, None
+    with metrics.timer('selection.sampling'):
+        data_sample = sample(data, sample_size)
+        trials = {codec.name: trial(codec, data_sample, encode, store) for codec in codecs}
+        name = choose(list(trials.values()), policy, time_budget)
+    metrics.count(f'selection.{name}')
+    whole = data_sample.size == np.asarray(data).size
+    return name, trials[name]['stored'] if whole else None
@@ -0,0 +1,150 @@
+'''
+Round trips of the codecs: container packets, streams and edge cases
+'''
+
+import os
+import numpy as np
+import pytest
+from registry import CODECS, get_codec
+from audio import to_symbols, from_symbols
+import lz77
+import lzw
+import Huffman_algo
+import deflate
+
+
+def fibonacci_counts(symbols: int) -> np.array:
+    '''
+    Symbol counts giving Huffman codes longer than the decoding table
+    '''
+    counts = [1, 1]
+    while len(counts) < symbols:
+        counts.append(counts[-1] + counts[-2])
+    return np.repeat(np.arange(symbols, dtype='uint8'), counts)
+
+
+SAMPLES = {
+    'empty': np.array([], dtype='uint8'),
+    'one_symbol': np.array([7], dtype='uint8'),
+    'constant': np.full(1000, 3, dtype='uint8'),
+    'random': np.random.default_rng(0).integers(0, 256, 5000, dtype='uint8'),
+    'text': np.frombuffer(b'abracadabra, abracadabra! ' * 200, dtype='uint8'),
+    'long_codes': fibonacci_counts(20),
+    'audio': (np.sin(np.arange(5000) / 9) * 9000).astype('int16'),
+}
+
+
+def round_trip(codec, data: np.array, level: int=lz77.DEFAULT_LEVEL) -> np.array:
+    '''
+    Encodes and decodes a packet as convert.py and player.py do
+    '''
+    signed = codec.nonnegative and data.dtype == np.int16
+    decoded = codec.decode(codec.encode(to_symbols(data) if signed else data, level))
+    decoded = np.asarray(decoded).ravel()
+    return from_symbols(decoded) if signed else decoded
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+@pytest.mark.parametrize('codec', CODECS)
+def test_packet_round_trip(codec, name):
+    data = SAMPLES[name]
+    decoded = round_trip(get_codec(codec), data)
+    assert np.array_equal(decoded, data)
+
+
+def test_long_codes_exceed_table():
+    data = SAMPLES['long_codes']
+    lengths = Huffman_algo.code_lengths(np.bincount(data))
+    assert lengths.max() > Huffman_algo.TABLE_BITS
+    assert np.array_equal(round_trip(get_codec('huffman'), data), data)
+
+
+@pytest.mark.parametrize('level', sorted(lz77.LEVELS))
+def test_lz77_levels_round_trip(level):
+    data = SAMPLES['text']
+    tokens = lz77.compress(data, level=level)
+    assert np.array_equal(lz77.decompress(tokens), data)
+    assert np.array_equal(lz77.decompress(tokens, vectorized=False), data)
+
+
+def test_lz77_tokens_serialization():
+    tokens = lz77.compress(SAMPLES['audio'])
+    restored = lz77.tokens_from_bytes(lz77.tokens_to_bytes(tokens))
+    assert restored.dtype == tokens.dtype
+    assert np.array_equal(restored, tokens)
+
+
+def test_lz77_two_symbol_matches():
+    # 'ab' repeats with other symbols between, a run cannot code it
+    data = np.frombuffer(b'abxaby' * 10, dtype='uint8')
+    tokens = lz77.compress(data)
+    assert np.any((tokens['offset'] != 0) & (tokens['length'] == 2))
+
+
+def to_bytes(part) -> bytes:
+    return part if isinstance(part, bytes) else np.asarray(part, dtype='uint8').tobytes()
+
+
+def stream(compressor, decompressor, data: np.array, chunk_size: int) -> np.array:
+    '''
+    Feeds data to the compressor in chunks and its output to the decompressor
+    '''
+    parts = []
+    for start in range(0, len(data), chunk_size):
+        parts.append(decompressor.feed(compressor.feed(data[start:start + chunk_size])))
+    parts.append(decompressor.feed(compressor.flush()))
+    parts.append(decompressor.flush())
+    return np.concatenate([np.asarray(part).ravel() for part in parts])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 4096])
+@pytest.mark.parametrize('module', [lz77, lzw, Huffman_algo, deflate])
+def test_stream_round_trip(module, chunk_size):
+    data = np.resize(SAMPLES['text'], 6000)
+    if module is lz77:
+        compressor = lz77.Compressor(max_length=300)
+    else:
+        compressor = module.Compressor()
+    decoded = stream(compressor, module.Decompressor(), data, chunk_size)
+    assert np.array_equal(decoded, data)
+
+
+def test_lzw_stream_in_one_piece():
+    data = np.resize(SAMPLES['text'], 6000)
+    compressor = lzw.Compressor()
+    parts = [compressor.feed(data[start:start + 100]) for start in range(0, len(data), 100)]
+    encoded = b''.join(to_bytes(part) for part in parts + [compressor.flush()])
+    assert np.array_equal(lzw.lzw_decompress(np.frombuffer(encoded, dtype='uint8')), data)
+
+
+@pytest.mark.parametrize('module', [lzw, Huffman_algo, deflate])
+def test_truncated_stream(module):
+    compressor = module.Compressor()
+    data = np.resize(SAMPLES['text'], 3000)
+    encoded = to_bytes(compressor.feed(data)) + to_bytes(compressor.flush())
+    decompressor = module.Decompressor()
+    decompressor.feed(np.frombuffer(encoded[:-1], dtype='uint8'))
+    with pytest.raises(ValueError):
+        decompressor.flush()
+
+
+def example_inputs() -> dict:
+    from PIL import Image
+    from filters import filter_image
+    examples = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+    with open(os.path.join(examples, 'text.txt'), 'rb') as file:
+        text = np.frombuffer(file.read(), dtype='uint8')
+    image = np.array(Image.open(os.path.join(examples, 'image.png')).convert('RGB'), dtype='uint8')
+    return {'text': text, 'image': filter_image(image).ravel()}
+
+
+@pytest.mark.parametrize('name', ['text', 'image'])
+def test_lz77_levels_do_not_add_tokens(name):
+    data = example_inputs()[name]
+    tokens = [len(lz77.compress(data, level=level)) for level in sorted(lz77.LEVELS)]
+    assert tokens == sorted(tokens, reverse=True)
+
+
+def test_lz77_has_every_compression_level():
+    from registry import COMPRESSION_LEVELS
+    assert tuple(sorted(lz77.LEVELS)) == COMPRESSION_LEVELS
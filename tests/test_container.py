@@ -0,0 +1,115 @@
+'''
+Round trips of the container file and reading of older versions
+'''
+
+import os
+import json
+import struct
+import numpy as np
+import pytest
+import container
+from container import (
+    ContainerWriter, ContainerReader, open_container, encode_payload, store_payload,
+    KEYFRAME, ZLIB, HEADER, MAGIC
+)
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+def write(path, packets, metadata=None):
+    '''
+    Writes (data, flags, codec) packets, returns the path
+    '''
+    metadata = metadata or {'media': 'video', 'codec': 'lz77', 'codecs': ['lz77', 'huffman']}
+    with ContainerWriter(str(path), metadata) as writer:
+        for data, flags, codec in packets:
+            writer.write_packet(encode_payload(codec, data, 5), flags, codec)
+    return str(path)
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    packets = [
+        (rng.integers(0, 4, 500, dtype='uint8'), KEYFRAME, 'lz77'),
+        (np.zeros(500, dtype='uint8'), 0, 'huffman'),
+        (np.array([], dtype='uint8'), 0, 'lz77'),
+        (rng.integers(0, 256, 500, dtype='uint8'), KEYFRAME, 'huffman'),
+    ]
+    with open_container(write(tmp_path / 'a.bzbv', packets)) as reader:
+        assert len(reader) == len(packets)
+        assert reader.metadata['codecs'] == ['lz77', 'huffman']
+        for number, (data, flags, codec) in enumerate(packets):
+            assert reader.codec(number) == codec
+            assert reader.is_keyframe(number) == bool(flags)
+            assert np.array_equal(np.asarray(reader.read(number)).ravel(), data)
+        assert reader.keyframe_before(2) == 0
+        assert reader.keyframe_before(3) == 3
+
+
+def test_stored_payloads(tmp_path):
+    '''
+    Payloads zlib makes smaller are stored compressed, others as they are
+    '''
+    rng = np.random.default_rng(0)
+    payloads = [bytes(1000), rng.bytes(1000), b'']
+    path = str(tmp_path / 'a.bzba')
+    with ContainerWriter(path, {'media': 'audio', 'codec': 'lz77'}) as writer:
+        for payload in payloads:
+            stored, flags = store_payload(payload)
+            writer.write_packet(stored, KEYFRAME | flags)
+    with open_container(path) as reader:
+        assert reader.index['flags'].tolist() == [KEYFRAME | ZLIB, KEYFRAME, KEYFRAME]
+        assert reader.index['size'][0] < len(payloads[0])
+        for number, payload in enumerate(payloads):
+            assert reader.is_keyframe(number)
+            assert reader.packet(number) == payload
+
+
+def test_no_packets(tmp_path):
+    with open_container(write(tmp_path / 'a.bzbv', [])) as reader:
+        assert len(reader) == 0
+
+
+def test_interrupted_write(tmp_path):
+    path = str(tmp_path / 'a.bzbi')
+    with pytest.raises(RuntimeError):
+        with ContainerWriter(path, {'media': 'image', 'codec': 'lz77'}) as writer:
+            writer.write_packet(b'payload')
+            raise RuntimeError
+    assert not (tmp_path / 'a.bzbi').exists()
+    assert not (tmp_path / 'a.bzbi.part').exists()
+
+
+def test_version_1_index(tmp_path):
+    '''
+    Version 1 indexes have no codec field, packets use the metadata codec
+    '''
+    data = np.arange(300, dtype='uint8') % 7
+    payload = encode_payload('lz77', data, 5)
+    metadata = json.dumps({'media': 'image', 'codec': 'lz77', 'shape': [10, 10, 3]}).encode()
+    index_offset = HEADER.size + len(metadata) + len(payload)
+    path = tmp_path / 'old.bzbi'
+    path.write_bytes(
+        HEADER.pack(MAGIC, 1, len(metadata), index_offset, 1) + metadata + payload +
+        struct.pack('<QII', HEADER.size + len(metadata), len(payload), KEYFRAME)
+    )
+    with open_container(str(path)) as reader:
+        assert reader.codec(0) == 'lz77'
+        assert np.array_equal(reader.read(0), data)
+
+
+def test_newer_version(tmp_path):
+    path = tmp_path / 'new.bzbi'
+    path.write_bytes(HEADER.pack(MAGIC, container.VERSION + 1, 2, 0, 0) + b'{}')
+    with pytest.raises(ValueError):
+        ContainerReader(str(path))
+
+
+@pytest.mark.parametrize('name', ['image.bzbi', 'image_deflate.bzbi', 'mouse.bzbv'])
+def test_bundled_legacy_files(name):
+    '''
+    Archives of older versions bundled with the examples still decode
+    '''
+    with open_container(os.path.join(EXAMPLES, name)) as reader:
+        decoded = np.asarray(reader.read(0)).ravel()
+        assert decoded.size == np.prod(reader.metadata['shape'])
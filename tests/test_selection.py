@@ -0,0 +1,72 @@
+'''
+Automatic codec choice: auto output is never larger than the output of
+the best single codec on the bundled examples
+'''
+
+import os
+import shutil
+import numpy as np
+import pytest
+from registry import CODECS
+from convert import Convert, inter_frames, DEFAULT_KEYFRAME_INTERVAL
+import selection
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+VIDEO_FRAMES = 20
+
+
+def test_image_not_larger_than_best_codec(tmp_path):
+    source = str(tmp_path / 'image.png')
+    shutil.copy(os.path.join(EXAMPLES, 'image.png'), source)
+    sizes = {}
+    for codec in [*CODECS, 'auto']:
+        converter = Convert(source, codec)
+        converter.save()
+        sizes[codec] = os.path.getsize(converter.output_path())
+    assert sizes['auto'] <= min(sizes[codec] for codec in CODECS)
+
+
+def packet_sizes(converter: Convert, packets: list) -> int:
+    return sum(len(converter.compress_packet(packet)[0]) for packet in packets)
+
+
+def test_video_frames_not_larger_than_best_codec():
+    moviepy = pytest.importorskip('moviepy.editor')
+    clip = moviepy.VideoFileClip(os.path.join(EXAMPLES, 'mouse.mov'))
+    try:
+        frames = [
+            frame for frame, _ in
+            inter_frames(clip.iter_frames(dtype='uint8'), DEFAULT_KEYFRAME_INTERVAL)
+        ][:VIDEO_FRAMES]
+    finally:
+        clip.close()
+    path = os.path.join(EXAMPLES, 'mouse.mov')
+    sizes = {codec: packet_sizes(Convert(path, codec), frames) for codec in [*CODECS, 'auto']}
+    assert sizes['auto'] <= min(sizes[codec] for codec in CODECS)
+
+
+def test_audio_packets_not_larger_than_best_codec():
+    try:
+        from pydub import AudioSegment
+        sound = AudioSegment.from_file(os.path.join(EXAMPLES, 'audio.mp3'), format='mp3')
+    except Exception as error:
+        pytest.skip(f'cannot decode mp3: {error}')
+    from audio import encode_samples, choose_stages
+    raw = np.array(sound.get_array_of_samples(), dtype='int16')[:1 << 18]
+    stages = choose_stages(raw, sound.channels)
+    size = int(sound.frame_rate / 2) * sound.channels
+    packets = [
+        encode_samples(raw[start:start + size], sound.channels, stages)
+        for start in range(0, len(raw), size)
+    ]
+    path = os.path.join(EXAMPLES, 'audio.mp3')
+    sizes = {codec: packet_sizes(Convert(path, codec), packets) for codec in [*CODECS, 'auto']}
+    assert sizes['auto'] <= min(sizes[codec] for codec in CODECS)
+
+
+def test_sample_is_contiguous():
+    data = np.arange(selection.WHOLE_PACKET_SIZE * 2, dtype='int64')
+    taken = selection.sample(data, 1 << 12)
+    assert taken.nbytes == 1 << 12
+    assert np.all(np.diff(taken) == 1)
+    assert selection.sample(data, None).size == data.size